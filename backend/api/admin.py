@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import shopping_list
 from .models import (
     Basket,
     Favorites,
@@ -7,6 +8,7 @@ from .models import (
     Ingredient,
     RecipeIngredient,
     Recipes,
+    ShoppingListItem,
     Tag,
 )
 
@@ -22,6 +24,20 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     list_filter = ("recipe", "ingredient")
     search_fields = ("recipe__name", "ingredient__name", "measurement_unit")
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        shopping_list.rebuild_for_recipes(
+            [obj.recipe_id, form.initial.get("recipe")])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        shopping_list.rebuild_for_recipes([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = list(queryset.values_list("recipe_id", flat=True))
+        super().delete_queryset(request, queryset)
+        shopping_list.rebuild_for_recipes(recipe_ids)
+
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
@@ -35,6 +51,13 @@ class RecipesAdmin(admin.ModelAdmin):
     search_fields = ("name", "author__username")
     inlines = (RecipeIngredientInline,)
 
+    def save_related(self, request, form, formsets, change):
+        recipe_id = form.instance.pk
+        amounts_before = shopping_list.recipe_amounts(recipe_id)
+        super().save_related(request, form, formsets, change)
+        shopping_list.change_recipe(recipe_id, shopping_list.amount_deltas(
+            amounts_before, shopping_list.recipe_amounts(recipe_id)))
+
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ("id", "name", "measurement_unit")
@@ -53,13 +76,25 @@ class FollowAdmin(admin.ModelAdmin):
 
 
 class BasketAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "recipe", "quantity", "cooking_time")
+    list_display = ("id", "user", "recipe", "quantity")
     list_filter = ("user", "recipe")
     search_fields = ("user__username", "recipe__name")
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        shopping_list.rebuild(
+            [user for user in (obj.user_id, form.initial.get("user")) if user])
+
+
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "ingredient", "total", "measurement_unit")
+    list_filter = ("user",)
+    search_fields = ("user__username", "ingredient__name")
+
 
 admin.site.register(RecipeIngredient, RecipeIngredientAdmin)
 admin.site.register(Basket, BasketAdmin)
+admin.site.register(ShoppingListItem, ShoppingListItemAdmin)
 admin.site.register(Follow, FollowAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
@@ -0,0 +1,117 @@
+"""Кэш справочников (теги, ингредиенты) с условными GET-запросами."""
+import hashlib
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test.utils import override_settings
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date
+
+from . import metrics
+
+CACHE_TIMEOUT: int = 60 * 60 * 24
+ISOLATED_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "foodgram-isolated",
+    },
+}
+
+
+def _version_key(group):
+    return f"reference:{group}:version"
+
+
+def get_version(group):
+    """Версия справочника — время его последнего изменения."""
+    version = cache.get(_version_key(group))
+    if version is None:
+        cache.add(_version_key(group), time.time(),
+                  settings.REFERENCE_CACHE_VERSION_TIMEOUT)
+        version = cache.get(_version_key(group))
+    return version
+
+
+@contextmanager
+def isolated():
+    """Отдельный кэш в памяти процесса на время тестов и бенчмарков.
+
+    Ответы, закэшированные на тестовой базе, не должны попасть в общий
+    кэш приложения и отдаваться потом на настоящей базе.
+    """
+    with override_settings(CACHES=ISOLATED_CACHES):
+        try:
+            yield
+        finally:
+            cache.clear()
+
+
+def invalidate(group):
+    """Сбрасывает все закэшированные ответы справочника group."""
+    cache.set(_version_key(group), time.time(),
+              settings.REFERENCE_CACHE_VERSION_TIMEOUT)
+
+
+class ReferenceCacheMixin:
+    """Кэширует отрендеренные ответы list и retrieve справочника.
+
+    Ответ хранится в кэше вместе с ETag и Last-Modified, повторный
+    запрос с If-None-Match или If-Modified-Since получает 304.
+    Ключ включает версию справочника, поэтому invalidate(cache_group)
+    сбрасывает все ответы сразу, а вместо полного URL - только
+    параметры из cache_params(), приведенные к одному виду.
+    """
+
+    cache_group = None
+
+    def cache_params(self, request):
+        """Параметры запроса, от которых зависит ответ."""
+        return sorted(request.query_params.lists())
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request,
+                                    *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        version = get_version(self.cache_group)
+        params = hashlib.md5(
+            repr(self.cache_params(request)).encode()).hexdigest()
+        key = "reference:{}:{}:{}:{}:{}".format(
+            self.cache_group, version, request.accepted_renderer.format,
+            request.path, params,
+        )
+        cached = cache.get(key)
+        metrics.cache_lookup(self.cache_group, cached is not None)
+        if cached is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+            cached = {
+                "content": response.content,
+                "content_type": response["Content-Type"],
+                "etag": '"{}"'.format(
+                    hashlib.md5(response.content).hexdigest()),
+            }
+            cache.set(key, cached, CACHE_TIMEOUT)
+
+        response = HttpResponse(cached["content"],
+                                content_type=cached["content_type"])
+        response["ETag"] = cached["etag"]
+        response["Last-Modified"] = http_date(version)
+        patch_cache_control(response, public=True, no_cache=True)
+        patch_vary_headers(response, ("Accept",))
+        return get_conditional_response(
+            request, etag=cached["etag"], last_modified=int(version),
+            response=response,
+        )
@@ -0,0 +1,138 @@
+"""Потоковая выгрузка рецептов в NDJSON или CSV.
+
+Рецепты читаются через iterator(chunk_size=CHUNK_SIZE): на PostgreSQL
+это серверный курсор, а теги и состав подгружаются отдельными запросами
+на каждую пачку, так что память не зависит от размера таблицы. Поля
+совпадают с форматом import_recipes.
+
+Инкрементальная выгрузка (since) отдает рецепты, у которых с этого
+момента менялся updated_at (в том числе через состав и теги, см.
+api.signals), и удаленные рецепты строками {"id": ..., "deleted": true}.
+Следующий since - next_since() от начала выгрузки: запас SINCE_OVERLAP
+покрывает транзакции, которые шли во время выгрузки и закоммитились
+позже. Повторно выгруженные рецепты получатель просто перезаписывает.
+"""
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import DeletedRecipe, RecipeIngredient, Recipes
+from .shopping_list import _Echo
+
+CHUNK_SIZE: int = 500
+GZIP_LEVEL: int = 6
+SINCE_OVERLAP = timedelta(minutes=5)
+CSV_FIELDS = ("id", "name", "text", "cooking_time", "tags", "ingredients",
+              "image", "author_id", "author", "updated_at", "deleted")
+
+
+def parse_since(value):
+    """Дата или дата-время ISO 8601; без часового пояса - в TIME_ZONE."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Некорректная дата: {value}")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def next_since(started):
+    """Значение since для выгрузки, следующей за начатой в started."""
+    return started - SINCE_OVERLAP
+
+
+def recipes(since=None):
+    queryset = Recipes.objects.defer("search_vector").select_related(
+        "author").prefetch_related(
+        "tags",
+        Prefetch("recipe_ingredients",
+                 RecipeIngredient.objects.select_related("ingredient")
+                 .order_by("ingredient__name")),
+    ).order_by("id")
+    if since is not None:
+        queryset = queryset.filter(updated_at__gte=since)
+    return queryset
+
+
+def deleted(since=None):
+    """Удаленные с since рецепты; полной выгрузке они не нужны."""
+    if since is None:
+        return DeletedRecipe.objects.none()
+    return DeletedRecipe.objects.filter(
+        deleted_at__gte=since).order_by("id")
+
+
+def _row(recipe):
+    return {
+        "id": recipe.pk,
+        "name": recipe.name,
+        "text": recipe.text,
+        "cooking_time": recipe.cooking_time,
+        "tags": [tag.slug for tag in recipe.tags.all()],
+        "ingredients": [
+            {
+                "name": item.ingredient.name,
+                "measurement_unit": item.ingredient.measurement_unit,
+                "amount": item.amount,
+            }
+            for item in recipe.recipe_ingredients.all()
+        ],
+        "image": recipe.image.name or "",
+        "author_id": recipe.author_id,
+        "author": recipe.author.username,
+        "updated_at": recipe.updated_at.isoformat(),
+    }
+
+
+def _deleted_row(recipe):
+    return {
+        "id": recipe.recipe_id,
+        "deleted": True,
+        "updated_at": recipe.deleted_at.isoformat(),
+    }
+
+
+def iter_ndjson(queryset, deleted=()):
+    for recipe in queryset.iterator(chunk_size=CHUNK_SIZE):
+        yield json.dumps(_row(recipe), ensure_ascii=False) + "\n"
+    for recipe in deleted:
+        yield json.dumps(_deleted_row(recipe)) + "\n"
+
+
+def iter_csv(queryset, deleted=()):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_FIELDS)
+    for recipe in queryset.iterator(chunk_size=CHUNK_SIZE):
+        row = _row(recipe)
+        row["tags"] = ";".join(row["tags"])
+        row["ingredients"] = ";".join(
+            f"{item['name']}|{item['measurement_unit']}|{item['amount']}"
+            for item in row["ingredients"])
+        yield writer.writerow([row.get(field, "") for field in CSV_FIELDS])
+    for recipe in deleted:
+        row = {**_deleted_row(recipe), "deleted": 1}
+        yield writer.writerow([row.get(field, "") for field in CSV_FIELDS])
+
+
+def gzip_stream(lines):
+    """Сжать поток строк в gzip, не собирая его в памяти."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for line in lines:
+        chunk = compressor.compress(line.encode())
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson; charset=utf-8", iter_ndjson),
+    "csv": ("text/csv; charset=utf-8", iter_csv),
+}
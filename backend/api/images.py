@@ -0,0 +1,210 @@
+"""Обработка изображений рецептов.
+
+Загрузка нормализуется сразу: поворот по EXIF и ограничение размеров.
+Уменьшенные копии (JPEG и WebP) строятся в фоновом пуле потоков
+после коммита транзакции, а для существующих файлов - командой
+generate_renditions.
+"""
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Recipes
+from .storage import content_storage
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_DIR: str = "renditions"
+RENDITIONS = {
+    "small": 320,
+    "medium": 960,
+}
+FORMATS = {
+    "": ("JPEG", ".jpg", {"quality": 85, "optimize": True,
+                          "progressive": True}),
+    "_webp": ("WEBP", ".webp", {"quality": 80, "method": 4}),
+}
+QUEUE_PER_WORKER: int = 8
+EXIF_ORIENTATION: int = 0x0112
+RELEASE_GRACE = timedelta(seconds=60)
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+def normalize(file):
+    """Повернуть по EXIF и уменьшить до IMAGE_MAX_SIZE.
+
+    Если изображение менять не нужно, возвращается исходный файл.
+    """
+    file.seek(0)
+    image = Image.open(file)
+    if getattr(image, "is_animated", False):
+        file.seek(0)
+        return file
+    max_size = settings.IMAGE_MAX_SIZE
+    # JPEG сразу декодируется в уменьшенном масштабе, так что память
+    # не зависит от исходного разрешения.
+    # exif_transpose() возвращает копию и без поворота, поэтому
+    # нужность поворота определяем по тегу Orientation.
+    orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+    if orientation == 1 and max(image.size) <= max_size:
+        file.seek(0)
+        return file
+    image_format = image.format
+    image.draft("RGB", (max_size, max_size))
+    transposed = ImageOps.exif_transpose(image)
+    transposed.thumbnail((max_size, max_size), Image.LANCZOS)
+    options = {}
+    if image_format == "JPEG":
+        options = FORMATS[""][2]
+        if transposed.mode not in ("RGB", "L"):
+            transposed = transposed.convert("RGB")
+    buffer = BytesIO()
+    transposed.save(buffer, format=image_format, **options)
+    return ContentFile(buffer.getvalue(), name=file.name)
+
+
+def rendition_name(name, size, suffix=""):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, RENDITIONS_DIR,
+                          f"{stem}_{size}{FORMATS[suffix][1]}")
+
+
+def rendition_names(name):
+    return {
+        f"{size}{suffix}": rendition_name(name, size, suffix)
+        for size in RENDITIONS for suffix in FORMATS
+    }
+
+
+def rendition_urls(image, request=None):
+    """Ссылки на оригинал и все уменьшенные копии изображения."""
+    if not image:
+        return None
+    urls = {"original": image.url}
+    for key, name in rendition_names(image.name).items():
+        urls[key] = default_storage.url(name)
+    if request is not None:
+        urls = {key: request.build_absolute_uri(url)
+                for key, url in urls.items()}
+    return urls
+
+
+def _flatten(image):
+    if image.mode in ("RGB", "L"):
+        return image
+    image = image.convert("RGBA")
+    background = Image.new("RGB", image.size, "white")
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+
+def render(name, force=False):
+    """Построить недостающие копии файла; возвращает число новых."""
+    targets = {
+        (size, suffix): rendition_name(name, size, suffix)
+        for size in RENDITIONS for suffix in FORMATS
+    }
+    if not force:
+        targets = {key: target for key, target in targets.items()
+                   if not default_storage.exists(target)}
+    if not targets:
+        return 0
+    with content_storage.open(name, "rb") as file:
+        source = Image.open(file)
+        largest = max(RENDITIONS.values())
+        source.draft("RGB", (largest, largest))
+        source = ImageOps.exif_transpose(source)
+        source.load()
+    for (size, suffix), target in targets.items():
+        image = source.copy()
+        image.thumbnail((RENDITIONS[size], RENDITIONS[size]), Image.LANCZOS)
+        image_format, _, options = FORMATS[suffix]
+        if image_format == "JPEG":
+            image = _flatten(image)
+        buffer = BytesIO()
+        image.save(buffer, format=image_format, **options)
+        if default_storage.exists(target):
+            default_storage.delete(target)
+        default_storage.save(target, ContentFile(buffer.getvalue()))
+    return len(targets)
+
+
+def delete(name):
+    """Удалить оригинал и его копии."""
+    for target in rendition_names(name).values():
+        default_storage.delete(target)
+    content_storage.delete(name)
+
+
+def releasable(name):
+    """Можно ли удалить файл: на него не ссылается ни один рецепт.
+
+    Рецепт с тем же содержимым мог только что получить этот файл в еще
+    не закоммиченной транзакции, и exists() его не видит. Такое
+    сохранение обновляет время изменения файла, поэтому файлы моложе
+    RELEASE_GRACE не удаляются. Их, как и файлы, оставшиеся после
+    откаченных транзакций, позже удаляет команда clean_images.
+    """
+    if not name or Recipes.objects.filter(image=name).exists():
+        return False
+    try:
+        modified = content_storage.get_modified_time(name)
+    except FileNotFoundError:
+        return False
+    return timezone.now() - modified >= RELEASE_GRACE
+
+
+def release(name):
+    """Удалить файл, если на него больше не ссылается ни один рецепт."""
+    if releasable(name):
+        delete(name)
+    elif name:
+        logger.info("Файл %s не удален: используется или недавно "
+                    "сохранен", name)
+
+
+def _get_executor():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            workers = settings.IMAGE_WORKERS
+            _executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="images")
+            _slots = threading.BoundedSemaphore(workers * QUEUE_PER_WORKER)
+    return _executor
+
+
+def _render_task(name):
+    try:
+        render(name)
+    except Exception:
+        logger.exception("Не удалось построить копии %s", name)
+    finally:
+        _slots.release()
+
+
+def schedule(name):
+    """Поставить файл в очередь пула.
+
+    Очередь ограничена: при переполнении вызывающий поток ждет.
+    """
+    executor = _get_executor()
+    _slots.acquire()
+    try:
+        return executor.submit(_render_task, name)
+    except BaseException:
+        _slots.release()
+        raise
@@ -0,0 +1,261 @@
+"""Массовый импорт рецептов из NDJSON или CSV.
+
+Строка NDJSON:
+    {"name": "Омлет", "text": "...", "cooking_time": 10,
+     "tags": ["breakfast"], "image": "omelet.jpg",
+     "ingredients": [{"name": "яйца", "measurement_unit": "шт",
+                      "amount": 2}]}
+CSV с заголовком name,text,cooking_time,tags,ingredients,image, где
+tags - "breakfast;lunch", ingredients - "яйца|шт|2;молоко|мл|50".
+
+Вход читается построчно и декодируется с errors="replace": строка с
+байтами не в UTF-8 отклоняется как ошибка этой строки. Теги (по slug или
+названию) и ингредиенты (по названию и единице измерения) сопоставляются
+по словарям в памяти, а рецепты с составом и тегами вставляются пачками
+по BATCH_SIZE.
+"""
+import csv
+import json
+import os
+import time
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.db import transaction
+
+from . import images
+from .models import Ingredient, RecipeIngredient, Recipes, Tag
+from .storage import content_storage
+
+BATCH_SIZE: int = 1000
+MAX_ERRORS: int = 100
+NAME_MAX_LENGTH = Recipes._meta.get_field("name").max_length
+MIN_AMOUNT: int = 1
+MAX_AMOUNT: int = 32000
+CSV_FIELDS = ("name", "text", "cooking_time", "tags", "ingredients", "image")
+# Им декодер с errors="replace" заменяет байты не в UTF-8.
+REPLACEMENT_CHARACTER = "\ufffd"
+
+
+class RowError(ValueError):
+    pass
+
+
+def iter_ndjson(lines):
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, None, f"некорректный JSON: {error}"
+            continue
+        if not isinstance(row, dict):
+            yield number, None, "ожидается объект JSON"
+            continue
+        yield number, row, None
+
+
+def _split(value, separator):
+    return [part.strip() for part in (value or "").split(separator)
+            if part.strip()]
+
+
+def iter_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        number = reader.line_num
+        try:
+            ingredients = []
+            for item in _split(row.get("ingredients"), ";"):
+                name, unit, amount = item.rsplit("|", 2)
+                ingredients.append({"name": name, "measurement_unit": unit,
+                                    "amount": amount})
+        except ValueError:
+            yield number, None, "ингредиент должен быть в виде имя|ед|кол-во"
+            continue
+        yield number, {
+            **row,
+            "tags": _split(row.get("tags"), ";"),
+            "ingredients": ingredients,
+        }, None
+
+
+FORMATS = {
+    "ndjson": iter_ndjson,
+    "csv": iter_csv,
+}
+
+
+def _undecodable(value):
+    if isinstance(value, str):
+        return REPLACEMENT_CHARACTER in value
+    if isinstance(value, dict):
+        value = [*value.keys(), *value.values()]
+    if isinstance(value, list):
+        return any(map(_undecodable, value))
+    return False
+
+
+def _amount(value, field):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{field}: ожидается целое число")
+    if not MIN_AMOUNT <= value <= MAX_AMOUNT:
+        raise RowError(f"{field}: допустимо от {MIN_AMOUNT} до {MAX_AMOUNT}")
+    return value
+
+
+class RecipeImporter:
+    """Импорт рецептов автора author.
+
+    images_root - каталог, относительно которого читаются пути к
+    изображениям; без него image - имя уже сохраненного файла.
+    """
+
+    def __init__(self, author, images_root=None, batch_size=BATCH_SIZE):
+        self.author = author
+        self.images_root = images_root
+        self.batch_size = batch_size
+        self.tags = {}
+        for tag_id, slug, name in Tag.objects.values_list(
+                "pk", "slug", "name"):
+            self.tags[slug.lower()] = tag_id
+            self.tags.setdefault(name.lower(), tag_id)
+        self.ingredients = {}
+        for ingredient_id, name, unit in Ingredient.objects.values_list(
+                "pk", "name", "measurement_unit").order_by("pk"):
+            self.ingredients.setdefault(
+                (name.strip().lower(), unit.strip().lower()), ingredient_id)
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    def _reject(self, number, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"line": number, "error": reason})
+
+    def _image(self, value):
+        if not value:
+            return None
+        value = str(value)
+        if self.images_root is None:
+            try:
+                exists = content_storage.exists(value)
+            except SuspiciousFileOperation:
+                raise RowError(f"image: недопустимый путь {value}")
+            if not exists:
+                raise RowError(f"image: файл {value} не найден")
+            return value
+        root = os.path.realpath(self.images_root)
+        path = os.path.realpath(os.path.join(root, value))
+        if os.path.commonpath([root, path]) != root:
+            raise RowError(f"image: недопустимый путь {value}")
+        if not os.path.isfile(path):
+            raise RowError(f"image: файл {value} не найден")
+        with open(path, "rb") as file:
+            return content_storage.save(
+                f"api/media/{os.path.basename(path)}", File(file))
+
+    def _clean(self, row):
+        name = str(row.get("name") or "").strip()
+        if not name or len(name) > NAME_MAX_LENGTH:
+            raise RowError(
+                f"name: от 1 до {NAME_MAX_LENGTH} символов")
+        text = str(row.get("text") or "").strip()
+        if not text:
+            raise RowError("text: обязательное поле")
+        cooking_time = _amount(row.get("cooking_time"), "cooking_time")
+
+        tag_ids = set()
+        for tag in row.get("tags") or ():
+            tag_id = self.tags.get(str(tag).strip().lower())
+            if tag_id is None:
+                raise RowError(f"tags: тег {tag} не найден")
+            tag_ids.add(tag_id)
+
+        amounts = {}
+        for item in row.get("ingredients") or ():
+            if not isinstance(item, dict):
+                raise RowError("ingredients: ожидается список объектов")
+            key = (str(item.get("name") or "").strip().lower(),
+                   str(item.get("measurement_unit") or "").strip().lower())
+            ingredient_id = self.ingredients.get(key)
+            if ingredient_id is None:
+                raise RowError(f"ingredients: {key[0]} ({key[1]}) не найден")
+            if ingredient_id in amounts:
+                raise RowError(f"ingredients: {key[0]} указан дважды")
+            amounts[ingredient_id] = _amount(item.get("amount"), "amount")
+        if not amounts:
+            raise RowError("ingredients: нужен хотя бы один ингредиент")
+
+        recipe = Recipes(author=self.author, name=name, text=text,
+                         cooking_time=cooking_time,
+                         image=self._image(row.get("image")))
+        return recipe, tag_ids, amounts
+
+    @transaction.atomic
+    def _save(self, batch):
+        recipes = Recipes.objects.bulk_create(
+            [recipe for recipe, _, _ in batch])
+        RecipeIngredient.objects.bulk_create(
+            [
+                RecipeIngredient(recipe_id=recipe.pk,
+                                 ingredient_id=ingredient_id, amount=amount)
+                for recipe, (_, _, amounts) in zip(recipes, batch)
+                for ingredient_id, amount in amounts.items()
+            ],
+            batch_size=self.batch_size,
+        )
+        through = Recipes.tags.through
+        through.objects.bulk_create(
+            [
+                through(recipes_id=recipe.pk, tag_id=tag_id)
+                for recipe, (_, tag_ids, _) in zip(recipes, batch)
+                for tag_id in tag_ids
+            ],
+            batch_size=self.batch_size,
+        )
+        names = {recipe.image.name for recipe in recipes if recipe.image}
+        for name in names:
+            transaction.on_commit(lambda name=name: images.schedule(name))
+        self.imported += len(recipes)
+
+    def run(self, rows):
+        """Импортировать rows - результат iter_ndjson или iter_csv."""
+        started = time.monotonic()
+        batch = []
+        for number, row, error in rows:
+            if error is None and row.get("deleted"):
+                # Удаление из инкрементальной выгрузки: импорт только
+                # добавляет рецепты.
+                continue
+            if error is None and _undecodable(row):
+                error = "некорректная кодировка, ожидается UTF-8"
+            if error is None:
+                try:
+                    batch.append(self._clean(row))
+                except RowError as row_error:
+                    error = str(row_error)
+            if error is not None:
+                self._reject(number, error)
+            if len(batch) >= self.batch_size:
+                self._save(batch)
+                batch = []
+        if batch:
+            self._save(batch)
+        self.seconds = time.monotonic() - started
+        return self.report()
+
+    def report(self):
+        return {
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 2),
+            "per_second": round(self.imported / self.seconds)
+            if self.seconds else self.imported,
+        }
@@ -0,0 +1,264 @@
+import io
+import json
+import math
+import os
+import random
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.authtoken.models import Token
+
+from api import cache
+from api.models import Basket, Favorites, Ingredient, Recipes
+from api.pagination import PAGE_SIZE
+from api.seeding import SIZES, Seeder
+from users.models import User
+
+# Допустимое число запросов и p95 в мс на эндпоинт. Порог времени
+# умножается на --latency-scale, чтобы подстроиться под машину.
+BUDGETS = {
+    "recipes": (5, 150),
+    "recipes page": (5, 150),
+    "recipes by tags": (5, 150),
+    "recipes search": (5, 200),
+    "recipes favorited": (5, 150),
+    "recipes in cart": (5, 150),
+    "recipe": (5, 50),
+    "subscriptions": (3, 100),
+    "favorite add": (6, 50),
+    "favorite remove": (3, 50),
+    "cart add": (15, 80),
+    "cart remove": (10, 80),
+    "subscribe": (8, 50),
+    "unsubscribe": (5, 50),
+    "download shopping cart": (2, 100),
+    "ingredients": (2, 100),
+    "ingredients search": (3, 50),
+    "tags": (2, 30),
+    "users": (3, 50),
+    "user": (3, 30),
+    "me": (3, 30),
+}
+# Сколько рецептов и авторов перебирают эндпоинты записи.
+CANDIDATES: int = 200
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Заполняет тестовую базу и замеряет задержку и число SQL '
+            'запросов на каждом эндпоинте; падает, если превышен бюджет')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            choices=SIZES,
+            default="small",
+            help="Набор размеров seed_fixtures (по умолчанию small)",
+        )
+        for name in SIZES["small"]:
+            parser.add_argument(
+                f"--{name}",
+                type=int,
+                help=f"Число строк {name} вместо значения из --size",
+            )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=50,
+            help="Запросов на эндпоинт",
+        )
+        parser.add_argument(
+            "--latency-scale",
+            type=float,
+            default=1.0,
+            help="Множитель порогов времени",
+        )
+        parser.add_argument(
+            "--no-latency",
+            action="store_true",
+            help="Проверять только число запросов",
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Не удалять тестовую базу и не заполнять ее повторно",
+        )
+        parser.add_argument(
+            "--json",
+            help="Сохранить результаты в файл JSON",
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, keepdb=options["keepdb"])
+        try:
+            with cache.isolated():
+                if not Recipes.objects.exists():
+                    started = time.monotonic()
+                    self.seed(options)
+                    self.stdout.write(f"База заполнена за "
+                                      f"{time.monotonic() - started:.1f} с")
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+        self.report(results, options)
+
+    def seed(self, options):
+        call_command("load_ingredients", stdout=io.StringIO())
+        sizes = {
+            name: options[name] if options[name] is not None else value
+            for name, value in SIZES[options["size"]].items()
+        }
+        # Тестовая база SQLite живет в памяти одного процесса.
+        workers = (os.cpu_count() if connection.vendor == "postgresql"
+                   else 1)
+        Seeder(sizes, seed=options["seed"], workers=workers).run()
+
+    def endpoints(self, user, rnd):
+        """Эндпоинты: (название, метод, url(i), запросы до и после).
+
+        Запросы до и после не замеряются и возвращают состояние назад:
+        добавленное в избранное тут же удаляется, а перед замером
+        удаления рецепт добавляется. Поэтому кандидатов хватает на любое
+        --requests.
+        """
+        recipe_ids = list(Recipes.objects.values_list("pk", flat=True))
+        sample = rnd.sample(recipe_ids, min(CANDIDATES, len(recipe_ids)))
+        free = [pk for pk in sample
+                if not Favorites.objects.filter(
+                    user=user, recipe_id=pk).exists()
+                and not Basket.objects.filter(
+                    user=user, recipe_id=pk).exists()]
+        other = User.objects.exclude(pk=user.pk).first()
+        authors = list(User.objects.exclude(pk=user.pk).exclude(
+            following__user=user).values_list("pk", flat=True)[:CANDIDATES])
+        if not free or not authors:
+            raise CommandError("Нет рецептов или авторов для замеров записи")
+        ingredient = Ingredient.objects.order_by("?").first()
+        pages = min(50, math.ceil(len(recipe_ids) / PAGE_SIZE))
+        return [
+            ("recipes", "get", lambda i: "/api/recipes/"),
+            ("recipes page", "get",
+             lambda i: f"/api/recipes/?page={i % pages + 1}"),
+            ("recipes by tags", "get",
+             lambda i: "/api/recipes/?tags=breakfast&tags=dinner"),
+            ("recipes search", "get",
+             lambda i: "/api/recipes/?search=суп"),
+            ("recipes favorited", "get",
+             lambda i: "/api/recipes/?is_favorited=1"),
+            ("recipes in cart", "get",
+             lambda i: "/api/recipes/?is_in_shopping_cart=1"),
+            ("recipe", "get",
+             lambda i: f"/api/recipes/{recipe_ids[i % len(recipe_ids)]}/"),
+            ("subscriptions", "get",
+             lambda i: "/api/users/subscriptions/?recipes_limit=3"),
+            ("favorite add", "post",
+             lambda i: f"/api/recipes/{free[i % len(free)]}/favorite/",
+             None, "delete"),
+            ("favorite remove", "delete",
+             lambda i: f"/api/recipes/{free[i % len(free)]}/favorite/",
+             "post", None),
+            ("cart add", "post",
+             lambda i: f"/api/recipes/{free[i % len(free)]}/shopping_cart/",
+             None, "delete"),
+            ("cart remove", "delete",
+             lambda i: f"/api/recipes/{free[i % len(free)]}/shopping_cart/",
+             "post", None),
+            ("subscribe", "post",
+             lambda i: f"/api/users/{authors[i % len(authors)]}/subscribe/",
+             None, "delete"),
+            ("unsubscribe", "delete",
+             lambda i: f"/api/users/{authors[i % len(authors)]}/subscribe/",
+             "post", None),
+            ("download shopping cart", "get",
+             lambda i: "/api/recipes/download_shopping_cart/"),
+            ("ingredients", "get", lambda i: "/api/ingredients/"),
+            ("ingredients search", "get",
+             lambda i: f"/api/ingredients/?name={ingredient.name[:3]}"),
+            ("tags", "get", lambda i: "/api/tags/"),
+            ("users", "get", lambda i: "/api/users/"),
+            ("user", "get", lambda i: f"/api/users/{other.pk}/"),
+            ("me", "get", lambda i: "/api/users/me/"),
+        ]
+
+    def run(self, options):
+        rnd = random.Random(options["seed"])
+        user = (User.objects.filter(follower__isnull=False)
+                .order_by("pk").first() or User.objects.first())
+        token, _ = Token.objects.get_or_create(user=user)
+        client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+        results = {}
+        for name, method, url, *around in self.endpoints(user, rnd):
+            before, after = around or (None, None)
+            timings = []
+            queries = 0
+            status = None
+            if method == "get":
+                # Прогрев: первый запрос заполняет кэши.
+                client.get(url(0))
+            for i in range(options["requests"]):
+                if before:
+                    getattr(client, before)(url(i))
+                # Журнал запросов ограничен по длине; на долгом прогоне
+                # срез CaptureQueriesContext по индексам оказался бы пуст.
+                reset_queries()
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(url(i))
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries = max(queries, len(context.captured_queries))
+                if after:
+                    getattr(client, after)(url(i))
+                status = max(status or 0, response.status_code)
+            results[name] = {
+                "status": status,
+                "queries": queries,
+                "p50": round(percentile(timings, 0.5), 1),
+                "p95": round(percentile(timings, 0.95), 1),
+                "p99": round(percentile(timings, 0.99), 1),
+            }
+        return results
+
+    def report(self, results, options):
+        failed = []
+        self.stdout.write(
+            f"{'эндпоинт':<24}{'код':>5}{'SQL':>5}"
+            f"{'p50':>9}{'p95':>9}{'p99':>9}  бюджет")
+        for name, row in results.items():
+            max_queries, max_p95 = BUDGETS[name]
+            max_p95 *= options["latency_scale"]
+            problems = []
+            if row["status"] >= 400:
+                problems.append(f"код {row['status']}")
+            if row["queries"] > max_queries:
+                problems.append(f"SQL {row['queries']} > {max_queries}")
+            if not options["no_latency"] and row["p95"] > max_p95:
+                problems.append(f"p95 {row['p95']} > {max_p95:.0f} мс")
+            line = (f"{name:<24}{row['status']:>5}{row['queries']:>5}"
+                    f"{row['p50']:>9}{row['p95']:>9}{row['p99']:>9}  "
+                    f"{max_queries} / {max_p95:.0f} мс")
+            if problems:
+                failed.append(f"{name}: {', '.join(problems)}")
+                line = self.style.ERROR(f"{line}  {'; '.join(problems)}")
+            self.stdout.write(line)
+        if options["json"]:
+            with open(options["json"], "w", encoding="utf-8") as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+        if failed:
+            raise CommandError("Превышен бюджет:\n" + "\n".join(failed))
+        self.stdout.write(self.style.SUCCESS("Все эндпоинты в бюджете"))
@@ -0,0 +1,97 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Value
+from django.db.models.functions import Upper
+
+from api.models import (Basket, Favorites, Follow, RecipeIngredient, Recipes,
+                        ShoppingListItem)
+from users.models import User
+
+# Полный проход по таблице в плане: "SCAN api_basket" без индекса на
+# SQLite, "Seq Scan on api_basket" на PostgreSQL.
+FULL_SCAN = {
+    "sqlite": re.compile(r"\bSCAN (\w+)(?! USING)(?=\s|$)"),
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+}
+
+
+def hot_queries(user_id, recipe_id, ingredient_id):
+    return {
+        "корзина: рецепт у пользователя": Basket.objects.filter(
+            user_id=user_id, recipe_id=recipe_id),
+        "корзины с рецептом": Basket.objects.filter(recipe_id=recipe_id),
+        "избранное: рецепт у пользователя": Favorites.objects.filter(
+            user_id=user_id, recipe_id=recipe_id),
+        "подписка на автора": Follow.objects.filter(
+            user_id=user_id, author_id=user_id),
+        "подписчики автора": Follow.objects.filter(author_id=user_id),
+        "состав рецепта": RecipeIngredient.objects.filter(
+            recipe_id=recipe_id).order_by(),
+        "ингредиент в рецепте": RecipeIngredient.objects.filter(
+            recipe_id=recipe_id, ingredient_id=ingredient_id),
+        "последние рецепты автора": Recipes.objects.filter(
+            author_id=user_id).order_by("-id")[:3],
+        "рецепты по тегу": Recipes.tags.through.objects.filter(tag_id=1),
+        "рецепты с изображением": Recipes.objects.filter(
+            image="api/media/00/00/image.jpg").order_by(),
+        "список покупок": ShoppingListItem.objects.filter(
+            user_id=user_id, total__gt=0).order_by(),
+        "вход по email": User.objects.alias(
+            email_upper=Upper("email")).filter(
+            email_upper=Upper(Value("user@example.com"))).order_by(),
+    }
+
+
+def explain_plans(user_id, recipe_id, ingredient_id):
+    """Планы hot_queries(): {название: (план, таблицы с полным проходом)}."""
+    pattern = FULL_SCAN[connection.vendor]
+    plans = {}
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            # На маленьких таблицах планировщик честно выбирает
+            # Seq Scan; проверяем, что индекс вообще применим.
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        for label, queryset in hot_queries(
+                user_id, recipe_id, ingredient_id).items():
+            plan = queryset.explain()
+            plans[label] = (plan, pattern.findall(plan))
+    return plans
+
+
+class Command(BaseCommand):
+    help = ('Проверяет через EXPLAIN, что частые запросы к таблицам '
+            'связей используют индексы')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Печатать планы целиком",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in FULL_SCAN:
+            raise CommandError(f"База {connection.vendor} не поддерживается")
+        user_id = User.objects.values_list("pk", flat=True).first() or 1
+        recipe_id = Recipes.objects.values_list("pk", flat=True).first() or 1
+        ingredient_id = RecipeIngredient.objects.filter(
+            recipe_id=recipe_id).values_list(
+            "ingredient_id", flat=True).first() or 1
+
+        failed = []
+        plans = explain_plans(user_id, recipe_id, ingredient_id)
+        for label, (plan, scans) in plans.items():
+            status = "OK" if not scans else (
+                f"полный проход: {', '.join(scans)}")
+            self.stdout.write(f"{label}: {status}")
+            if options["verbose_plans"] or scans:
+                self.stdout.write(f"    {plan}".replace("\n", "\n    "))
+            if scans:
+                failed.append(label)
+        if failed:
+            raise CommandError(
+                f"Запросы без индекса: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS("Все запросы используют индексы"))
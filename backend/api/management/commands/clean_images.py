@@ -0,0 +1,48 @@
+import posixpath
+
+from django.core.management.base import BaseCommand
+
+from api import images
+from api.models import Recipes
+from api.storage import content_storage, is_hashed
+
+
+def stored_names(directory):
+    """Оригиналы в хранилище по хешу, без каталогов с копиями."""
+    directories, files = content_storage.listdir(directory)
+    for name in files:
+        name = posixpath.join(directory, name)
+        if is_hashed(name):
+            yield name
+    for child in directories:
+        if child != images.RENDITIONS_DIR:
+            yield from stored_names(posixpath.join(directory, child))
+
+
+class Command(BaseCommand):
+    help = ('Удаляет изображения, на которые не ссылается ни один '
+            'рецепт, вместе с их копиями')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать, сколько файлов будет удалено",
+        )
+
+    def handle(self, *args, **options):
+        root = Recipes._meta.get_field("image").upload_to
+        if not content_storage.exists(root):
+            self.stdout.write("Изображений нет")
+            return
+        files = deleted = 0
+        for name in stored_names(root.rstrip("/")):
+            files += 1
+            if not images.releasable(name):
+                continue
+            deleted += 1
+            if not options["dry_run"]:
+                images.delete(name)
+        label = "к удалению" if options["dry_run"] else "удалено"
+        self.stdout.write(self.style.SUCCESS(
+            f"Файлов: {files}, {label}: {deleted}"))
@@ -0,0 +1,64 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import export
+
+
+class Command(BaseCommand):
+    help = 'Выгружает рецепты с составом, тегами и автором в NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            "-o",
+            default="-",
+            help="Файл для выгрузки (по умолчанию - stdout); "
+                 "окончание .gz включает сжатие",
+        )
+        parser.add_argument(
+            "--format",
+            choices=export.FORMATS,
+            default="ndjson",
+        )
+        parser.add_argument(
+            "--since",
+            help="Только рецепты, измененные с этого момента (ISO 8601)",
+        )
+        parser.add_argument(
+            "--gzip",
+            action="store_true",
+            help="Сжать выгрузку gzip",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            since = (export.parse_since(options["since"])
+                     if options["since"] else None)
+        except ValueError as error:
+            raise CommandError(error)
+        output = options["output"]
+        compress = options["gzip"] or output.endswith(".gz")
+        started = timezone.now()
+
+        _, render = export.FORMATS[options["format"]]
+        chunks = render(export.recipes(since), export.deleted(since))
+        if compress:
+            chunks = export.gzip_stream(chunks)
+        if output == "-":
+            for chunk in chunks:
+                if compress:
+                    sys.stdout.buffer.write(chunk)
+                else:
+                    self.stdout.write(chunk, ending="")
+        else:
+            options = ({"mode": "wb"} if compress else
+                       {"mode": "w", "encoding": "utf-8", "newline": ""})
+            with open(output, **options) as file:
+                for chunk in chunks:
+                    file.write(chunk)
+
+        self.stderr.write(
+            f"Выгрузка на {started.isoformat()}, следующая: --since "
+            f"{export.next_since(started).isoformat()}")
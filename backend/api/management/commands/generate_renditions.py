@@ -0,0 +1,60 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api import images
+from api.models import Recipes
+
+CHUNK_SIZE: int = 16
+
+
+def render(task):
+    name, force = task
+    try:
+        return name, images.render(name, force=force), None
+    except Exception as error:
+        return name, 0, str(error)
+
+
+class Command(BaseCommand):
+    help = ('Строит уменьшенные копии (JPEG и WebP) для уже '
+            'загруженных изображений рецептов')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Число процессов (по умолчанию - по числу ядер)",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Перестроить и уже существующие копии",
+        )
+
+    def handle(self, *args, **options):
+        names = list(
+            Recipes.objects.exclude(image="").exclude(image__isnull=True)
+            .values_list("image", flat=True).distinct()
+        )
+        # Дочерним процессам база не нужна, соединение им не передаем.
+        connections.close_all()
+        tasks = [(name, options["force"]) for name in names]
+        started = time.monotonic()
+        files = created = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            for name, count, error in pool.map(render, tasks,
+                                               chunksize=CHUNK_SIZE):
+                files += 1
+                created += count
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{name}: {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Файлов: {files}, новых копий: {created}, ошибок: {failed} "
+            f"за {time.monotonic() - started:.1f} с"
+        ))
@@ -0,0 +1,61 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import importer
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Импортирует рецепты из файла NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл .ndjson/.jsonl или .csv")
+        parser.add_argument(
+            "--author",
+            required=True,
+            help="username или email автора рецептов",
+        )
+        parser.add_argument(
+            "--format",
+            choices=importer.FORMATS,
+            help="Формат файла (по умолчанию - по расширению)",
+        )
+        parser.add_argument(
+            "--images-dir",
+            help="Каталог с изображениями (по умолчанию - рядом с файлом)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=importer.BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or (
+            "csv" if path.lower().endswith(".csv") else "ndjson")
+        author = User.objects.filter(username=options["author"]).first() or (
+            User.objects.filter(email__iexact=options["author"]).first())
+        if author is None:
+            raise CommandError(f"Пользователь {options['author']} не найден")
+
+        recipe_importer = importer.RecipeImporter(
+            author,
+            images_root=(options["images_dir"]
+                         or os.path.dirname(os.path.abspath(path))),
+            batch_size=options["batch_size"],
+        )
+        with open(path, encoding="utf-8-sig", errors="replace",
+                  newline="") as file:
+            report = recipe_importer.run(
+                importer.FORMATS[file_format](file))
+
+        for error in report["errors"]:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(
+            f"Импортировано: {report['imported']}, "
+            f"отклонено: {report['rejected']} "
+            f"за {report['seconds']} с ({report['per_second']} рецептов/с)"
+        ))
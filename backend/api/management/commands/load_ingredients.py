@@ -1,18 +1,172 @@
-from django.core.management.base import BaseCommand
-from api.models import Ingredient
+import csv
+import io
 import json
+import os
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api import cache
+from api.models import Ingredient, search_key
+
+BATCH_SIZE: int = 1000
+DIFF_PREVIEW: int = 20
+
+
+def iter_csv(file):
+    """Строки "название,единица" без заголовка."""
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1] if len(row) > 1 else ""
+
+
+def iter_json(file):
+    """Массив JSON или по объекту JSON на строку (NDJSON)."""
+    first = file.read(1)
+    while first.isspace():
+        first = file.read(1)
+    if first == "[":
+        rows = json.loads(first + file.read())
+    else:
+        rows = (json.loads(line) for line in
+                (first + file.readline(), *file) if line.strip())
+    for row in rows:
+        yield row["name"], row.get("measurement_unit", "")
+
+
+FORMATS = {
+    "csv": iter_csv,
+    "json": iter_json,
+}
+
+
+def normalize(rows):
+    """Убрать лишние пробелы и повторы внутри файла."""
+    seen = set()
+    for name, unit in rows:
+        key = (name.strip(), unit.strip())
+        if key[0] and key not in seen:
+            seen.add(key)
+            yield key
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def existing(batch):
+    """Строки пачки, которые уже есть в базе."""
+    names = {name for name, _ in batch}
+    return set(batch) & set(Ingredient.objects.filter(
+        name__in=names).values_list("name", "measurement_unit"))
+
+
+def insert_orm(batch):
+    present = existing(batch)
+    Ingredient.objects.bulk_create(
+        [Ingredient(name=name, measurement_unit=unit,
+                    name_search=search_key(name))
+         for name, unit in batch if (name, unit) not in present],
+        ignore_conflicts=True,
+    )
+    return len(batch) - len(present)
+
+
+def insert_copy(batch):
+    """COPY во временную таблицу и INSERT ... ON CONFLICT DO NOTHING."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        (name, unit, search_key(name)) for name, unit in batch)
+    buffer.seek(0)
+    table = Ingredient._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE ingredients_load "
+            "(name text, measurement_unit text, name_search text) "
+            "ON COMMIT DROP")
+        cursor.copy_expert(
+            "COPY ingredients_load FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO {table} (name, measurement_unit, name_search) "
+            f"SELECT name, measurement_unit, name_search "
+            f"FROM ingredients_load "
+            f"ON CONFLICT (name, measurement_unit) DO NOTHING")
+        return cursor.rowcount
 
 
 class Command(BaseCommand):
-    help = 'Загружает ингредиенты из файла JSON в базу данных'
+    help = ('Загружает ингредиенты из CSV или JSON; повторный запуск '
+            'добавляет только новые')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            default="data/ingredients.csv",
+            help="Файл с ингредиентами (по умолчанию data/ingredients.csv)",
+        )
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="Формат файла (по умолчанию - по расширению)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать, какие ингредиенты будут добавлены",
+        )
+        parser.add_argument(
+            "--no-copy",
+            action="store_true",
+            help="Не использовать COPY на PostgreSQL",
+        )
 
     def handle(self, *args, **options):
-        with open("data/ingredients.json", "r", encoding="utf-8-sig") as file:
-            ingredients = json.load(file)
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"Файл {path} не найден")
+        file_format = options["format"] or (
+            "json" if path.lower().endswith((".json", ".jsonl", ".ndjson"))
+            else "csv")
+        insert = insert_orm
+        if connection.vendor == "postgresql" and not options["no_copy"]:
+            insert = insert_copy
 
-        Ingredient.objects.bulk_create(
-            [Ingredient(name=ingredient_data["name"]) for ingredient_data in
-             ingredients]
-        )
+        total = added = 0
+        preview = []
+        with open(path, encoding="utf-8-sig", newline="") as file:
+            rows = normalize(FORMATS[file_format](file))
+            for batch in batches(rows, options["batch_size"]):
+                total += len(batch)
+                if options["dry_run"]:
+                    present = existing(batch)
+                    new = [row for row in batch if row not in present]
+                    added += len(new)
+                    preview.extend(new[:DIFF_PREVIEW - len(preview)])
+                    continue
+                # Каждая пачка в своей транзакции: строки не
+                # блокируются надолго, а повторный запуск продолжит
+                # с того же места.
+                with transaction.atomic():
+                    added += insert(batch)
 
-        self.stdout.write(self.style.SUCCESS('Ингредиенты успешно загружены'))
+        if options["dry_run"]:
+            for name, unit in preview:
+                self.stdout.write(f"+ {name} ({unit})")
+            self.stdout.write(
+                f"В файле: {total}, будет добавлено: {added}, "
+                f"уже есть: {total - added}")
+            return
+        if added:
+            cache.invalidate("ingredients")
+        self.stdout.write(self.style.SUCCESS(
+            f"Ингредиенты загружены: в файле {total}, добавлено {added}, "
+            f"уже были {total - added}"))
@@ -0,0 +1,51 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from api import images
+from api.models import Recipes
+from api.storage import content_storage, is_hashed
+
+
+class Command(BaseCommand):
+    help = ('Переносит изображения рецептов в хранилище по хешу '
+            'содержимого и удаляет освободившиеся старые файлы')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать, сколько файлов будет перенесено",
+        )
+
+    def handle(self, *args, **options):
+        names = [
+            name for name in Recipes.objects
+            .exclude(image="").exclude(image__isnull=True)
+            .values_list("image", flat=True).distinct().iterator()
+            if not is_hashed(name)
+        ]
+        if options["dry_run"]:
+            self.stdout.write(f"К переносу: {len(names)} файлов")
+            return
+
+        moved = missing = 0
+        stored = set()
+        for name in names:
+            if not content_storage.exists(name):
+                missing += 1
+                self.stderr.write(f"{name}: файл не найден")
+                continue
+            with content_storage.open(name, "rb") as file:
+                new_name = content_storage.save(name, file)
+            Recipes.objects.filter(image=name).update(image=new_name)
+            images.delete(name)
+            stored.add(new_name)
+            moved += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Перенесено: {moved}, уникальных файлов: {len(stored)}, "
+            f"не найдено: {missing}"
+        ))
+        if stored:
+            call_command("generate_renditions", stdout=self.stdout,
+                         stderr=self.stderr)
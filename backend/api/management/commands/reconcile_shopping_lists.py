@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from api import shopping_list
+from api.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает списки покупок по корзинам и сообщает, '
+            'насколько они расходились')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать расхождения, ничего не меняя",
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            (row["user_id"], row["ingredient_id"]): row["total"]
+            for row in shopping_list.expected_totals().iterator(
+                chunk_size=shopping_list.CHUNK_SIZE)
+            if row["total"] > 0
+        }
+        actual = dict(
+            ((user_id, ingredient_id), total)
+            for user_id, ingredient_id, total in ShoppingListItem.objects
+            .filter(total__gt=0)
+            .values_list("user_id", "ingredient_id", "total")
+            .iterator(chunk_size=shopping_list.CHUNK_SIZE)
+        )
+        missing = expected.keys() - actual.keys()
+        extra = actual.keys() - expected.keys()
+        changed = [key for key in expected.keys() & actual.keys()
+                   if expected[key] != actual[key]]
+        users = {user_id for user_id, _ in (*missing, *extra, *changed)}
+
+        self.stdout.write(
+            f"Строк в списках: ожидается {len(expected)}, "
+            f"сейчас {len(actual)}\n"
+            f"Отсутствуют: {len(missing)}, лишние: {len(extra)}, "
+            f"с другим итогом: {len(changed)}, "
+            f"затронуто пользователей: {len(users)}"
+        )
+        if options["dry_run"]:
+            return
+        shopping_list.rebuild()
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересобраны'))
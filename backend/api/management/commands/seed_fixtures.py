@@ -0,0 +1,59 @@
+import io
+import os
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.models import Ingredient
+from api.seeding import PASSWORD, SIZES, Seeder
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу тестовыми пользователями, подписками, '
+            'рецептами, избранным и корзинами')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            choices=SIZES,
+            default="small",
+            help="Набор размеров (по умолчанию small)",
+        )
+        for name in SIZES["small"]:
+            parser.add_argument(
+                f"--{name}",
+                type=int,
+                help=f"Число строк {name} вместо значения из --size",
+            )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Число процессов (по умолчанию - по числу ядер на "
+                 "PostgreSQL и 1 на остальных СУБД)",
+        )
+        parser.add_argument(
+            "--password",
+            default=PASSWORD,
+            help=f"Пароль пользователей (по умолчанию {PASSWORD})",
+        )
+
+    def handle(self, *args, **options):
+        sizes = {
+            name: options[name] if options[name] is not None else value
+            for name, value in SIZES[options["size"]].items()
+        }
+        if min(sizes.values()) < 0 or sizes["users"] < 2:
+            raise CommandError("Нужно хотя бы два пользователя")
+        workers = options["workers"]
+        if workers is None:
+            workers = (os.cpu_count() if connection.vendor == "postgresql"
+                       else 1)
+        if not Ingredient.objects.exists():
+            call_command("load_ingredients", stdout=io.StringIO())
+        seeder = Seeder(sizes, seed=options["seed"], workers=workers,
+                        password=options["password"], log=self.stdout.write)
+        rows = seeder.run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано строк: {sum(rows.values())} за {seeder.seconds:.1f} с"))
@@ -0,0 +1,127 @@
+"""Метрики Prometheus: запросы, база данных, кэш справочников, вход.
+
+Под gunicorn с несколькими процессами метрики пишутся в файлы каталога
+PROMETHEUS_MULTIPROC_DIR (его готовит gunicorn.conf.py) и собираются
+MultiProcessCollector при чтении /metrics; без этой переменной
+используется реестр текущего процесса.
+
+MetricsMiddleware размечает запросы именем маршрута (recipes-list,
+download_shopping_cart, subscriptions, favorite-recepi, token, ...), так
+что число меток ограничено набором маршрутов.
+"""
+import os
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+UNMATCHED = "unmatched"
+
+REQUEST_LATENCY = Histogram(
+    "foodgram_request_duration_seconds",
+    "Время обработки запроса",
+    ["view", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter(
+    "foodgram_requests_total",
+    "Запросы по маршруту, методу и коду ответа",
+    ["view", "method", "status"],
+)
+DB_QUERIES = Histogram(
+    "foodgram_db_queries_per_request",
+    "Число SQL-запросов на один запрос",
+    ["view"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+DB_SECONDS = Counter(
+    "foodgram_db_query_duration_seconds_total",
+    "Суммарное время SQL-запросов",
+    ["view"],
+)
+CACHE_REQUESTS = Counter(
+    "foodgram_reference_cache_requests_total",
+    "Обращения к кэшу справочников",
+    ["group", "result"],
+)
+AUTH = Counter(
+    "foodgram_auth_total",
+    "Попытки входа и выхода",
+    ["action", "result"],
+)
+
+
+def cache_lookup(group, hit):
+    CACHE_REQUESTS.labels(group, "hit" if hit else "miss").inc()
+
+
+def auth_attempt(action, success):
+    AUTH.labels(action, "success" if success else "failure").inc()
+
+
+class _QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        match = request.resolver_match
+        view = (match.view_name or match.route) if match else UNMATCHED
+        REQUEST_LATENCY.labels(view, request.method).observe(
+            time.perf_counter() - started)
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        DB_QUERIES.labels(view).observe(timer.count)
+        DB_SECONDS.labels(view).inc(timer.seconds)
+        return response
+
+
+def _authorized(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        header = request.headers.get("Authorization", "")
+        return constant_time_compare(header, f"Bearer {token}")
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus.
+
+    Доступ по заголовку "Authorization: Bearer <METRICS_TOKEN>", а если
+    токен не задан - только сотрудникам, вошедшим в админку.
+    """
+    if not _authorized(request):
+        return HttpResponseForbidden()
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:08
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="recipes",
+            options={
+                "ordering": ["-id"],
+                "verbose_name": "Рецепт",
+                "verbose_name_plural": "Рецепты",
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:08
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0002_recipes_ordering"),
+    ]
+
+    operations = [
+        # Таблица связи создается Django автоматически, поэтому индекс
+        # (tag_id, recipes_id) для фильтра по тегам добавляется вручную.
+        migrations.RunSQL(
+            sql=(
+                "CREATE INDEX api_recipes_tags_tag_recipe_idx "
+                "ON api_recipes_tags (tag_id, recipes_id);"
+            ),
+            reverse_sql="DROP INDEX api_recipes_tags_tag_recipe_idx;",
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:10
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# search_vector поддерживается триггером, поэтому остается актуальным и при
+# save(), и при bulk_create/update. Вне PostgreSQL колонка не заполняется:
+# Recipes.objects.search() там ищет по подстроке.
+CREATE_SEARCH_VECTOR = """
+CREATE FUNCTION api_recipes_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('pg_catalog.russian',
+                              coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('pg_catalog.russian',
+                              coalesce(NEW.text, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER api_recipes_search_vector_trigger
+BEFORE INSERT OR UPDATE OF name, text ON api_recipes
+FOR EACH ROW EXECUTE PROCEDURE api_recipes_search_vector_update();
+
+UPDATE api_recipes SET name = name;
+
+CREATE INDEX api_recipes_search_vector_gin
+ON api_recipes USING gin (search_vector);
+"""
+
+DROP_SEARCH_VECTOR = """
+DROP INDEX IF EXISTS api_recipes_search_vector_gin;
+DROP TRIGGER IF EXISTS api_recipes_search_vector_trigger ON api_recipes;
+DROP FUNCTION IF EXISTS api_recipes_search_vector_update();
+"""
+
+
+def create_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_SEARCH_VECTOR)
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_SEARCH_VECTOR)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0003_recipes_tags_tag_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipes",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
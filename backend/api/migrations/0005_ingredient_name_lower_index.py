@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:12
+
+from django.db import migrations
+
+# Индекс для Ingredient.objects.autocomplete(): LOWER(name) LIKE 'префикс%'.
+# text_pattern_ops нужен, чтобы LIKE использовал индекс при любой локали.
+CREATE_NAME_LOWER_INDEX = """
+CREATE INDEX api_ingredient_name_lower_idx
+ON api_ingredient (lower(name) text_pattern_ops);
+"""
+
+DROP_NAME_LOWER_INDEX = """
+DROP INDEX IF EXISTS api_ingredient_name_lower_idx;
+"""
+
+
+def create_name_lower_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_NAME_LOWER_INDEX)
+
+
+def drop_name_lower_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_NAME_LOWER_INDEX)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0004_recipes_search_vector"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_name_lower_index, drop_name_lower_index),
+    ]
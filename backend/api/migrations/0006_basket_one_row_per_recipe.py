@@ -0,0 +1,68 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:13
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def collapse_duplicate_baskets(apps, schema_editor):
+    """Оставляет одну строку корзины на пару (user, recipe).
+
+    Раньше в корзину добавлялась строка на каждый ингредиент рецепта с
+    одинаковым quantity, поэтому сохраняется максимальное значение.
+    """
+    Basket = apps.get_model("api", "Basket")
+    duplicates = (
+        Basket.objects.values("user_id", "recipe_id")
+        .annotate(keep_id=Min("id"), quantity=Max("quantity"),
+                  rows=Count("id"))
+        .order_by()
+    )
+    for row in duplicates.iterator():
+        quantity = min(max(row["quantity"], 1), 32000)
+        Basket.objects.filter(pk=row["keep_id"]).update(quantity=quantity)
+        if row["rows"] > 1:
+            Basket.objects.filter(
+                user_id=row["user_id"], recipe_id=row["recipe_id"]
+            ).exclude(pk=row["keep_id"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0005_ingredient_name_lower_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            collapse_duplicate_baskets, migrations.RunPython.noop
+        ),
+        migrations.RemoveField(
+            model_name="basket",
+            name="cooking_time",
+        ),
+        migrations.RemoveField(
+            model_name="basket",
+            name="image",
+        ),
+        migrations.RemoveField(
+            model_name="basket",
+            name="ingredient",
+        ),
+        migrations.AlterField(
+            model_name="basket",
+            name="quantity",
+            field=models.PositiveSmallIntegerField(
+                default=1,
+                validators=[
+                    django.core.validators.MinValueValidator(1),
+                    django.core.validators.MaxValueValidator(32000),
+                ],
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="basket",
+            constraint=models.UniqueConstraint(
+                fields=("user", "recipe"), name="unique_basket"
+            ),
+        ),
+    ]
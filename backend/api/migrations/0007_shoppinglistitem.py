@@ -0,0 +1,84 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F, Sum
+
+
+def fill_shopping_lists(apps, schema_editor):
+    RecipeIngredient = apps.get_model("api", "RecipeIngredient")
+    ShoppingListItem = apps.get_model("api", "ShoppingListItem")
+    totals = (
+        RecipeIngredient.objects.filter(recipe__baskets__isnull=False)
+        .values(
+            "ingredient_id",
+            user_id=F("recipe__baskets__user_id"),
+            unit=F("ingredient__measurement_unit"),
+        )
+        .annotate(total=Sum(F("amount") * F("recipe__baskets__quantity")))
+        .order_by()
+    )
+    ShoppingListItem.objects.bulk_create(
+        [
+            ShoppingListItem(
+                user_id=row["user_id"],
+                ingredient_id=row["ingredient_id"],
+                measurement_unit=row["unit"],
+                total=row["total"],
+            )
+            for row in totals
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("api", "0006_basket_one_row_per_recipe"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShoppingListItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("measurement_unit", models.CharField(max_length=200)),
+                ("total", models.BigIntegerField(default=0)),
+                (
+                    "ingredient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="api.ingredient"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="shopping_list",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Список покупок",
+                "verbose_name_plural": "Списки покупок",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="shoppinglistitem",
+            constraint=models.UniqueConstraint(
+                fields=("user", "ingredient"), name="unique_shopping_list_item"
+            ),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:25
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0007_shoppinglistitem"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="recipes",
+            name="image",
+            field=models.ImageField(
+                default=None,
+                null=True,
+                storage=api.storage.get_content_storage,
+                upload_to="api/media/",
+            ),
+        ),
+    ]
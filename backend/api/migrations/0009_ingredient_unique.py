@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:28
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Оставляет один ингредиент на пару (name, measurement_unit).
+
+    Ссылки из рецептов и списков покупок переносятся на оставшийся
+    ингредиент; если в рецепте или списке уже есть обе строки,
+    количества складываются.
+    """
+    Ingredient = apps.get_model("api", "Ingredient")
+    RecipeIngredient = apps.get_model("api", "RecipeIngredient")
+    ShoppingListItem = apps.get_model("api", "ShoppingListItem")
+    duplicates = (
+        Ingredient.objects.values("name", "measurement_unit")
+        .annotate(keep_id=Min("id"), rows=Count("id"))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for row in duplicates.iterator():
+        keep_id = row["keep_id"]
+        merged = list(
+            Ingredient.objects.filter(
+                name=row["name"], measurement_unit=row["measurement_unit"]
+            )
+            .exclude(pk=keep_id)
+            .values_list("pk", flat=True)
+        )
+        for model, owner, total, limit in (
+            (RecipeIngredient, "recipe_id", "amount", 32000),
+            (ShoppingListItem, "user_id", "total", None),
+        ):
+            links = model.objects.filter(ingredient_id__in=[keep_id, *merged])
+            for group in (
+                links.values(owner)
+                .annotate(keep_pk=Min("id"), rows=Count("id"), summed=Sum(total))
+                .filter(rows__gt=1)
+                .order_by()
+            ):
+                value = group["summed"]
+                if limit is not None:
+                    value = min(value, limit)
+                links.filter(pk=group["keep_pk"]).update(**{total: value})
+                links.filter(**{owner: group[owner]}).exclude(
+                    pk=group["keep_pk"]
+                ).delete()
+            links.filter(ingredient_id__in=merged).update(ingredient_id=keep_id)
+        Ingredient.objects.filter(pk__in=merged).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0008_recipes_image_content_storage"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="ingredient",
+            constraint=models.UniqueConstraint(
+                fields=("name", "measurement_unit"), name="unique_ingredient"
+            ),
+        ),
+    ]
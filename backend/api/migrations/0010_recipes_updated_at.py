@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0009_ingredient_unique"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipes",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
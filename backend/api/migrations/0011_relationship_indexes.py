@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:34
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_recipe_ingredients(apps, schema_editor):
+    """Оставляет одну строку на пару (recipe, ingredient), суммируя количество.
+
+    Итоги списков покупок считались по всем строкам, поэтому сумма
+    сохраняет их без пересчета (кроме ограничения в 32000).
+    """
+    RecipeIngredient = apps.get_model("api", "RecipeIngredient")
+    duplicates = (
+        RecipeIngredient.objects.values("recipe_id", "ingredient_id")
+        .annotate(keep_id=Min("id"), rows=Count("id"), summed=Sum("amount"))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for row in duplicates.iterator():
+        RecipeIngredient.objects.filter(pk=row["keep_id"]).update(
+            amount=min(row["summed"], 32000)
+        )
+        RecipeIngredient.objects.filter(
+            recipe_id=row["recipe_id"], ingredient_id=row["ingredient_id"]
+        ).exclude(pk=row["keep_id"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0010_recipes_updated_at"),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name="follow",
+            unique_together=set(),
+        ),
+        migrations.AddIndex(
+            model_name="recipes",
+            index=models.Index(fields=["author", "-id"], name="recipe_author_latest"),
+        ),
+        migrations.AddIndex(
+            model_name="shoppinglistitem",
+            index=models.Index(
+                condition=models.Q(("total__gt", 0)),
+                fields=["user"],
+                name="shopping_list_nonempty",
+            ),
+        ),
+        migrations.RunPython(
+            merge_duplicate_recipe_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="recipeingredient",
+            constraint=models.UniqueConstraint(
+                fields=("recipe", "ingredient"), name="unique_recipe_ingredient"
+            ),
+        ),
+    ]
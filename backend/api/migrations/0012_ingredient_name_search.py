@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:41
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+# Индекс из 0005 по lower(name) больше не используется: подсказки ищут
+# по name_search.
+CREATE_NAME_LOWER_INDEX = """
+CREATE INDEX api_ingredient_name_lower_idx
+ON api_ingredient (lower(name) text_pattern_ops);
+"""
+
+DROP_NAME_LOWER_INDEX = """
+DROP INDEX IF EXISTS api_ingredient_name_lower_idx;
+"""
+
+
+def fill_name_search(apps, schema_editor):
+    Ingredient = apps.get_model("api", "Ingredient")
+    batch = []
+    for ingredient in Ingredient.objects.only("name").iterator(
+            chunk_size=BATCH_SIZE):
+        ingredient.name_search = ingredient.name.casefold()
+        batch.append(ingredient)
+        if len(batch) == BATCH_SIZE:
+            Ingredient.objects.bulk_update(batch, ["name_search"])
+            batch = []
+    Ingredient.objects.bulk_update(batch, ["name_search"])
+
+
+def drop_name_lower_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_NAME_LOWER_INDEX)
+
+
+def create_name_lower_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_NAME_LOWER_INDEX)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0011_relationship_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingredient",
+            name="name_search",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=255
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_name_search, migrations.RunPython.noop),
+        migrations.RunPython(drop_name_lower_index, create_name_lower_index),
+    ]
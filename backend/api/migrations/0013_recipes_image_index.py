@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:42
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0012_ingredient_name_search"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="recipes",
+            name="image",
+            field=models.ImageField(
+                db_index=True,
+                default=None,
+                null=True,
+                storage=api.storage.get_content_storage,
+                upload_to="api/media/",
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0013_recipes_image_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeletedRecipe",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("recipe_id", models.BigIntegerField()),
+                ("deleted_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                "verbose_name": "Удаленный рецепт",
+                "verbose_name_plural": "Удаленные рецепты",
+            },
+        ),
+    ]
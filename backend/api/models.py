@@ -1,7 +1,13 @@
-from django.db import models
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
+from django.db import connection, models
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 from users.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from .storage import get_content_storage
+
 
 class Tag(models.Model):
     name = models.CharField(max_length=30)
@@ -17,17 +23,151 @@ class Tag(models.Model):
         ordering = ['name']
 
 
+def search_key(name):
+    """Название для поиска без учета регистра, в том числе кириллицы.
+
+    LOWER() в SQLite меняет регистр только у латиницы, поэтому ключ
+    считается в Python и хранится в Ingredient.name_search.
+    """
+    return name.casefold()
+
+
+class IngredientQuerySet(models.QuerySet):
+    def autocomplete(self, name, limit):
+        """Подсказки по началу названия ингредиента без учета регистра.
+
+        Сначала идут названия, начинающиеся с name (индекс по
+        name_search), и только если их меньше limit — содержащие name.
+        """
+        name = search_key(name)
+        queryset = self.order_by("name_search")
+        found = list(queryset.filter(name_search__startswith=name)[:limit])
+        if len(found) < limit:
+            found += queryset.filter(name_search__contains=name).exclude(
+                name_search__startswith=name)[:limit - len(found)]
+        return found
+
+
 class Ingredient(models.Model):
     name = models.CharField(max_length=255)
     measurement_unit = models.CharField(max_length=200)
+    # Заполняется в save(); bulk_create и сырой SQL передают его сами.
+    name_search = models.CharField(max_length=255, db_index=True,
+                                   editable=False)
+
+    objects = IngredientQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.name_search = search_key(self.name)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "name" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "name_search"}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "measurement_unit"],
+                name="unique_ingredient",
+            ),
+        ]
+
+
+class RecipesQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        """Флаги is_favorited и is_in_shopping_cart одним запросом.
+
+        Для анонимного пользователя аннотации не добавляются.
+        """
+        if not user.is_authenticated:
+            return self
+        return self.annotate(
+            is_favorited=models.Exists(Favorites.objects.filter(
+                user=user, recipe=models.OuterRef("pk"))),
+            is_in_shopping_cart=models.Exists(Basket.objects.filter(
+                user=user, recipe=models.OuterRef("pk"))),
+        )
+
+    def with_tags(self, tags):
+        """Рецепты, у которых есть хотя бы один из тегов tags.
+
+        Фильтр идет через IN-подзапрос по таблице связи recipes-tag и
+        индексу (tag_id, recipes_id), поэтому соединение не размножает
+        строки и DISTINCT не нужен.
+        """
+        return self.filter(pk__in=Recipes.tags.through.objects.filter(
+            tag__in=tags).values("recipes_id"))
+
+    def search(self, query):
+        """Полнотекстовый поиск по названию и описанию рецепта.
+
+        В PostgreSQL используется колонка search_vector с GIN-индексом и
+        ранжированием, в остальных СУБД — поиск подстроки, где совпадения
+        в названии идут первыми.
+        """
+        if connection.vendor == "postgresql":
+            search_query = SearchQuery(query, config="russian",
+                                       search_type="websearch")
+            return self.filter(search_vector=search_query).annotate(
+                rank=SearchRank(models.F("search_vector"), search_query),
+            ).order_by("-rank", "-id")
+        return self.filter(
+            models.Q(name__icontains=query) | models.Q(text__icontains=query)
+        ).annotate(
+            rank=models.Case(
+                models.When(name__icontains=query, then=models.Value(1.0)),
+                default=models.Value(0.5),
+                output_field=models.FloatField(),
+            ),
+        ).order_by("-rank", "-id")
+
+    def latest_for_authors(self, author_ids, limit=None):
+        """Последние limit рецептов каждого автора одним запросом.
+
+        Отбор идет оконной функцией ROW_NUMBER() OVER (PARTITION BY
+        author_id ORDER BY id DESC), без limit возвращаются все рецепты.
+        """
+        queryset = self.filter(author_id__in=author_ids).only(
+            "id", "author_id", "name", "image", "cooking_time")
+        if limit is not None:
+            queryset = queryset.annotate(row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=models.F("author_id"),
+                order_by=models.F("id").desc(),
+            )).filter(row_number__lte=limit)
+        return queryset.order_by("author_id", "-id")
+
+    def touch(self):
+        """Отметить рецепты измененными для инкрементальной выгрузки."""
+        return self.update(updated_at=timezone.now())
+
+    def with_related(self, user):
+        """План загрузки связанных данных для RecipesSerializer.
+
+        Автор, теги и ингредиенты загружаются фиксированным числом
+        запросов, флаг подписки на автора считается в основном запросе.
+        """
+        queryset = self.defer("search_vector").select_related(
+            "author").prefetch_related(
+            "tags",
+            models.Prefetch(
+                "recipe_ingredients",
+                queryset=RecipeIngredient.objects.select_related(
+                    "ingredient").order_by("ingredient__name"),
+            ),
+        )
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            author_subscribed=models.Exists(Follow.objects.filter(
+                user=user, author=models.OuterRef("author"))),
+        )
 
 
 class Recipes(models.Model):
@@ -35,26 +175,46 @@ class Recipes(models.Model):
                                on_delete=models.CASCADE)
     name = models.CharField(max_length=30)
     tags = models.ManyToManyField(Tag)
-    image = models.ImageField(upload_to="api/media/", null=True, default=None)
+    # Индекс для images.release(): есть ли еще рецепты с этим файлом.
+    image = models.ImageField(upload_to="api/media/", null=True, default=None,
+                              storage=get_content_storage, db_index=True)
     cooking_time = models.PositiveIntegerField()
     ingredients = models.ManyToManyField(
         Ingredient, through="RecipeIngredient", through_fields=("recipe",
                                                                 "ingredient")
     )
     text = models.TextField()
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = RecipesQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
+        ordering = ["-id"]
+        indexes = [
+            # Последние рецепты автора: подписки, страница автора.
+            models.Index(fields=["author", "-id"],
+                         name="recipe_author_latest"),
+        ]
 
     def __str__(self):
         return self.name
 
-    def is_favorite_for_user(self, user):
-        return Favorites.objects.filter(user=user, recipe=self).exists()
 
-    def is_in_shopping_cart_for_user(self, user):
-        return Basket.objects.filter(user=user, recipe=self).exists()
+class DeletedRecipe(models.Model):
+    """Удаленный рецепт: попадает в инкрементальную выгрузку как удаление."""
+
+    recipe_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.recipe_id} ({self.deleted_at:%Y-%m-%d %H:%M})"
+
+    class Meta:
+        verbose_name = "Удаленный рецепт"
+        verbose_name_plural = "Удаленные рецепты"
 
 
 class RecipeIngredient(models.Model):
@@ -73,6 +233,12 @@ class RecipeIngredient(models.Model):
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ['recipe__name', 'ingredient__name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipe", "ingredient"],
+                name="unique_recipe_ingredient",
+            )
+        ]
 
 
 class Basket(models.Model):
@@ -80,14 +246,10 @@ class Basket(models.Model):
                                on_delete=models.CASCADE,
                                related_name='baskets')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    quantity = models.IntegerField()
-    cooking_time = models.PositiveSmallIntegerField(
+    quantity = models.PositiveSmallIntegerField(
+        default=1,
         validators=[MinValueValidator(1), MaxValueValidator(32000)]
     )
-    image = models.ImageField(upload_to="api/media/", null=True, default=None)
-    ingredient = models.ForeignKey(
-        Ingredient, on_delete=models.CASCADE, null=True, blank=True
-    )
 
     def __str__(self):
         return f"{self.user.username}'Добавил(а) - {self.recipe.name}"
@@ -96,6 +258,45 @@ class Basket(models.Model):
         verbose_name = "Корзина"
         verbose_name_plural = "Корзина"
         ordering = ['user__username', 'recipe__name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"],
+                name="unique_basket",
+            )
+        ]
+
+
+class ShoppingListItem(models.Model):
+    """Итог по ингредиенту в списке покупок пользователя.
+
+    Поддерживается инкрементально модулем api.shopping_list при изменении
+    корзины и состава рецептов; reconcile_shopping_lists пересобирает
+    таблицу с нуля.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='shopping_list')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    measurement_unit = models.CharField(max_length=200)
+    total = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.ingredient.name}: {self.total}"
+
+    class Meta:
+        verbose_name = "Список покупок"
+        verbose_name_plural = "Списки покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_list_item",
+            )
+        ]
+        indexes = [
+            # Выгрузка списка: только ненулевые строки пользователя.
+            models.Index(fields=["user"], condition=models.Q(total__gt=0),
+                         name="shopping_list_nonempty"),
+        ]
 
 
 class Favorites(models.Model):
@@ -130,7 +331,6 @@ class Follow(models.Model):
         return f"{self.user.username} - {self.author.username}"
 
     class Meta:
-        unique_together = (("author", "user"),)
         constraints = [
             models.UniqueConstraint(
                 fields=["user", "author"],
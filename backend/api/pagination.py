@@ -1,5 +1,69 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
+
+PAGE_SIZE: int = 6
+MAX_PAGE_SIZE: int = 100
 
 
 class Pagination(PageNumberPagination):
-    page_size = 6
+    page_size = PAGE_SIZE
+    page_size_query_param = "limit"
+    max_page_size = MAX_PAGE_SIZE
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная пагинация по первичному ключу.
+
+    Глубокие страницы стоят столько же, сколько первая: нет ни COUNT(*),
+    ни OFFSET, только условие по индексу id.
+    """
+
+    page_size = PAGE_SIZE
+    page_size_query_param = "limit"
+    max_page_size = MAX_PAGE_SIZE
+    ordering = "-id"
+
+
+class HybridPagination(BasePagination):
+    """Курсорная пагинация с постраничным режимом для совместимости.
+
+    Если в запросе есть параметр page (его всегда передает фронтенд),
+    ответ строится через Pagination, иначе через KeysetPagination.
+    Поиск (search) тоже идет через Pagination: курсор упорядочивает по
+    id и отбросил бы сортировку по релевантности.
+    """
+
+    page_query_param = Pagination.page_query_param
+    ranked_query_params = ("search",)
+
+    def __init__(self):
+        self.paginator = KeysetPagination()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.page_query_param in params or any(
+                params.get(name) for name in self.ranked_query_params):
+            self.paginator = Pagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = Pagination().get_schema_operation_parameters(view)
+        names = {parameter["name"] for parameter in parameters}
+        return parameters + [
+            parameter for parameter
+            in KeysetPagination().get_schema_operation_parameters(view)
+            if parameter["name"] not in names
+        ]
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    @property
+    def display_page_controls(self):
+        return self.paginator.display_page_controls
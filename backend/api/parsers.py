@@ -0,0 +1,52 @@
+import json
+
+from django.utils.datastructures import MultiValueDict
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+
+class FlatData(dict):
+    """Данные формы, к которым request.data добавляет файлы.
+
+    DRF собирает request.data как data.copy().update(files). Обычный
+    dict.update() взял бы из MultiValueDict списки значений, поэтому
+    здесь берется последнее значение, как в QueryDict.
+    """
+
+    def copy(self):
+        return type(self)(self)
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, MultiValueDict):
+            other = other.dict()
+        super().update(other, **kwargs)
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """multipart/form-data для рецептов.
+
+    Файлы пишутся во временные файлы (FILE_UPLOAD_HANDLERS), а
+    вложенные поля передаются строкой JSON: ingredients='[{"id": 1,
+    "amount": 10}]'. Теги можно передать и повторяющимся полем tags.
+    """
+
+    json_fields = ("ingredients", "tags")
+    list_fields = ("tags",)
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parsed = super().parse(stream, media_type, parser_context)
+        data = FlatData()
+        for key, values in parsed.data.lists():
+            if key in self.json_fields and (
+                    len(values) == 1 and values[0].lstrip()[:1] in "[{"):
+                try:
+                    data[key] = json.loads(values[0])
+                except ValueError as error:
+                    raise ParseError(f"{key}: некорректный JSON - {error}")
+            elif key in self.list_fields:
+                data[key] = values
+            else:
+                data[key] = values[-1]
+        # Файлы остаются MultiValueDict: HttpRequest.close() закрывает
+        # временные файлы через files.lists().
+        return DataAndFiles(data, parsed.files)
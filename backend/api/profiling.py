@@ -0,0 +1,148 @@
+"""Профилирование запросов: SQL, время view и сериализации.
+
+Включается настройкой PROFILING_ENABLED; выключенный ProfilingMiddleware
+бросает MiddlewareNotUsed и не остается в цепочке обработчиков, а
+BaseSerializer.data подменяется только при включенном профилировании.
+
+На каждый запрос считаются число и время SQL-запросов по всем базам
+(connection.execute_wrapper), время обработки и время сериализации.
+Итог уходит в заголовок Server-Timing. Одинаковые запросы, повторенные
+не меньше PROFILING_DUPLICATE_THRESHOLD раз (N+1), отмечаются вместе с
+местом вызова в коде проекта. Медленные запросы (от PROFILING_SLOW_MS)
+с вероятностью PROFILING_SAMPLE_RATE пишутся в лог api.profiling одной
+строкой JSON.
+"""
+import contextvars
+import json
+import logging
+import random
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = str(Path(settings.BASE_DIR).resolve())
+SQL_PREVIEW: int = 200
+MAX_DUPLICATES: int = 10
+
+_current = contextvars.ContextVar("profile", default=None)
+
+
+def _call_site():
+    """Ближайший к запросу кадр стека из кода проекта."""
+    for frame in reversed(traceback.extract_stack()[:-3]):
+        if (frame.filename.startswith(PROJECT_ROOT)
+                and "site-packages" not in frame.filename
+                and frame.filename != __file__):
+            path = Path(frame.filename).relative_to(PROJECT_ROOT)
+            return f"{path}:{frame.lineno} in {frame.name}"
+    return None
+
+
+class Profile:
+    def __init__(self, duplicate_threshold):
+        self.duplicate_threshold = duplicate_threshold
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+        self.statements = Counter()
+        self.call_sites = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+            if self.statements[sql] == self.duplicate_threshold:
+                self.call_sites[sql] = _call_site()
+
+    def duplicates(self):
+        return [
+            {"sql": sql[:SQL_PREVIEW], "count": count,
+             "call_site": self.call_sites.get(sql)}
+            for sql, count in self.statements.most_common(MAX_DUPLICATES)
+            if count >= self.duplicate_threshold
+        ]
+
+
+def _patch_serializers():
+    """Учитывать время BaseSerializer.data в текущем профиле."""
+    original = BaseSerializer.data
+    if getattr(original.fget, "profiled", False):
+        return
+
+    def data(self):
+        profile = _current.get()
+        if profile is None or profile.serializing:
+            return original.fget(self)
+        profile.serializing = True
+        started = time.perf_counter()
+        try:
+            return original.fget(self)
+        finally:
+            profile.serializer_seconds += time.perf_counter() - started
+            profile.serializing = False
+
+    data.profiled = True
+    BaseSerializer.data = property(data)
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.slow_seconds = settings.PROFILING_SLOW_MS / 1000
+        self.duplicate_threshold = settings.PROFILING_DUPLICATE_THRESHOLD
+        _patch_serializers()
+
+    def __call__(self, request):
+        profile = Profile(self.duplicate_threshold)
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        seconds = time.perf_counter() - started
+        duplicates = profile.duplicates()
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={profile.sql_seconds * 1000:.1f};'
+            f'desc="{profile.queries} queries"',
+            f"serialize;dur={profile.serializer_seconds * 1000:.1f}",
+            f"app;dur={seconds * 1000:.1f}",
+            *([f'n1;desc="{len(duplicates)} repeated queries"']
+              if duplicates else []),
+        ])
+        if seconds >= self.slow_seconds and (
+                random.random() < self.sample_rate):
+            match = request.resolver_match
+            logger.warning(json.dumps({
+                "event": "slow_request",
+                "method": request.method,
+                "path": request.path,
+                "view": match.view_name if match else None,
+                "status": response.status_code,
+                "ms": round(seconds * 1000, 1),
+                "sql_count": profile.queries,
+                "sql_ms": round(profile.sql_seconds * 1000, 1),
+                "serializer_ms": round(profile.serializer_seconds * 1000, 1),
+                "duplicates": duplicates,
+            }, ensure_ascii=False))
+        return response
@@ -0,0 +1,94 @@
+"""Связи текущего пользователя в пределах одного запроса.
+
+Избранное, корзина и подписки загружаются лениво, не больше одного раза
+за запрос каждое, и только для id, которые сериализуются на странице,
+если они известны заранее (см. UserRelations.limit_to).
+"""
+from .models import Basket, Favorites, Follow
+
+
+class UserRelations:
+    def __init__(self, user):
+        self.user = user
+        self._ids = {}
+        self._scope = {}
+
+    def _sources(self):
+        return {
+            "favorites": (Favorites.objects.filter(user=self.user),
+                          "recipe_id"),
+            "cart": (Basket.objects.filter(user=self.user), "recipe_id"),
+            "following": (Follow.objects.filter(user=self.user),
+                          "author_id"),
+        }
+
+    def limit_to(self, recipe_ids=None, author_ids=None):
+        """Загружать связи только для этих рецептов и авторов.
+
+        Если позже спросят id вне этих границ, набор будет
+        загружен заново, уже полностью.
+        """
+        if recipe_ids is not None:
+            for name in ("favorites", "cart"):
+                self._limit(name, recipe_ids)
+        if author_ids is not None:
+            self._limit("following", author_ids)
+
+    def _limit(self, name, ids):
+        if name in self._ids and name not in self._scope:
+            return
+        scope = self._scope.setdefault(name, set())
+        if not scope.issuperset(ids):
+            scope.update(ids)
+            self._ids.pop(name, None)
+
+    def _contains(self, name, pk):
+        if not self.user.is_authenticated:
+            return False
+        scope = self._scope.get(name)
+        if scope is not None and pk not in scope:
+            del self._scope[name]
+            self._ids.pop(name, None)
+            scope = None
+        if name not in self._ids:
+            queryset, field = self._sources()[name]
+            if scope is not None:
+                queryset = queryset.filter(**{f"{field}__in": scope})
+            self._ids[name] = set(queryset.values_list(field, flat=True))
+        return pk in self._ids[name]
+
+    def _update(self, name, pk, present):
+        ids = self._ids.get(name)
+        if ids is not None:
+            if present:
+                ids.add(pk)
+            else:
+                ids.discard(pk)
+
+    def is_favorited(self, recipe_id):
+        return self._contains("favorites", recipe_id)
+
+    def is_in_shopping_cart(self, recipe_id):
+        return self._contains("cart", recipe_id)
+
+    def is_subscribed(self, author_id):
+        return self._contains("following", author_id)
+
+    def set_favorited(self, recipe_id, value=True):
+        self._update("favorites", recipe_id, value)
+
+    def set_in_shopping_cart(self, recipe_id, value=True):
+        self._update("cart", recipe_id, value)
+
+    def set_subscribed(self, author_id, value=True):
+        self._update("following", author_id, value)
+
+
+def user_relations(request):
+    """UserRelations текущего запроса, создается при первом обращении."""
+    http_request = getattr(request, "_request", request)
+    relations = getattr(http_request, "user_relations", None)
+    if relations is None:
+        relations = UserRelations(request.user)
+        http_request.user_relations = relations
+    return relations
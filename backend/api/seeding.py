@@ -0,0 +1,295 @@
+"""Генерация тестовых данных для нагрузочных тестов и бенчмарков.
+
+Пользователи, подписки, рецепты с тегами и составом из справочника
+ингредиентов, избранное и корзины. Популярность авторов, рецептов и
+ингредиентов, а также активность пользователей распределены по
+степенному закону: немногие получают большую часть связей.
+
+Первичные ключи пользователей и рецептов назначаются заранее, а работа
+режется на пачки, у каждой из которых свой генератор случайных чисел
+от seed. Поэтому пачки можно вставлять в любом порядке и в нескольких
+процессах, а результат зависит только от seed и размеров.
+"""
+import bisect
+import heapq
+import itertools
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+
+from . import cache, shopping_list
+from .models import (Basket, Favorites, Follow, Ingredient, RecipeIngredient,
+                     Recipes, Tag)
+from users.models import User
+
+BATCH_SIZE: int = 5000
+RECIPES_PER_TASK: int = 2000
+USERS_PER_TASK: int = 500
+# Показатель степенного закона: чем больше, тем сильнее перекос.
+ALPHA: float = 1.1
+MIN_INGREDIENTS: int = 5
+MAX_INGREDIENTS: int = 30
+MAX_TAGS: int = 3
+PASSWORD = "seed-password"
+
+SIZES = {
+    "small": {"users": 200, "recipes": 5_000, "follows": 2_000,
+              "favorites": 20_000, "carts": 5_000},
+    "medium": {"users": 1_000, "recipes": 20_000, "follows": 20_000,
+               "favorites": 100_000, "carts": 20_000},
+    "large": {"users": 10_000, "recipes": 100_000, "follows": 200_000,
+              "favorites": 1_000_000, "carts": 200_000},
+}
+TAGS = (("Завтрак", "#E26C2D", "breakfast"), ("Обед", "#49B64E", "lunch"),
+        ("Ужин", "#8775D2", "dinner"), ("Десерт", "#F9A62B", "dessert"),
+        ("Постное", "#2D9CDB", "lenten"))
+WORDS = ("суп", "салат", "пирог", "каша", "рагу", "запеканка", "омлет",
+         "соус", "оладьи", "плов", "борщ", "котлеты", "паста", "торт",
+         "домашний", "быстрый", "летний", "острый", "сырный", "овощной",
+         "куриный", "грибной", "ягодный", "мамин", "праздничный")
+
+
+def _random(seed, *key):
+    return random.Random(":".join(map(str, (seed, *key))))
+
+
+@lru_cache(maxsize=8)
+def _popularity(seed, kind, first_id, count):
+    """Идентификаторы first_id.. в случайном порядке и накопленные веса.
+
+    Вес i-го по популярности убывает как 1 / i ** ALPHA.
+    """
+    ids = list(range(first_id, first_id + count))
+    _random(seed, kind, "order").shuffle(ids)
+    weights = itertools.accumulate(
+        1 / rank ** ALPHA for rank in range(1, count + 1))
+    return ids, list(weights)
+
+
+def _pick(rnd, ids, weights, count, exclude=None):
+    """count разных идентификаторов с учетом популярности."""
+    if count * 10 > len(ids):
+        # Много связей: взвешенная выборка без возвращения по ключам
+        # u ** (1 / вес), иначе редкие значения пришлось бы ждать долго.
+        ranked = heapq.nlargest(
+            count + 1, range(len(ids)),
+            key=lambda rank: rnd.random() ** ((rank + 1) ** ALPHA))
+        return sorted([ids[rank] for rank in ranked
+                       if ids[rank] != exclude][:count])
+    picked = set()
+    total = weights[-1]
+    while len(picked) < count:
+        value = ids[bisect.bisect(weights, rnd.random() * total)]
+        if value != exclude:
+            picked.add(value)
+    return sorted(picked)
+
+
+def activity(seed, kind, count, total, limit):
+    """Число связей у каждого из count пользователей, в сумме ~total.
+
+    Никому не достается больше limit: избыток делится между остальными.
+    """
+    ids, weights = _popularity(seed, kind, 0, count)
+    shares = dict(zip(ids, [weights[0]] + [
+        after - before for before, after in zip(weights, weights[1:])]))
+    result = [0] * count
+    while shares and total > 0:
+        scale = total / sum(shares.values())
+        capped = {index for index, share in shares.items()
+                  if share * scale >= limit}
+        if not capped:
+            for index, share in shares.items():
+                result[index] = round(share * scale)
+            break
+        for index in capped:
+            result[index] = limit
+            del shares[index]
+        total -= limit * len(capped)
+    return result
+
+
+def _name(rnd, number):
+    return f"{' '.join(rnd.sample(WORDS, 2)).capitalize()} {number}"[:30]
+
+
+def _seed_recipes(plan, first, last):
+    rnd = _random(plan["seed"], "recipes", first)
+    authors, author_weights = _popularity(
+        plan["seed"], "authors", plan["first_user"], plan["users"])
+    ingredients, ingredient_weights = plan["ingredients"]
+    units = plan["units"]
+    recipes, items, tags = [], [], []
+    through = Recipes.tags.through
+    for pk in range(first, last):
+        recipes.append(Recipes(
+            pk=pk,
+            author_id=_pick(rnd, authors, author_weights, 1)[0],
+            name=_name(rnd, pk),
+            text=" ".join(rnd.choices(WORDS, k=rnd.randint(20, 80))),
+            cooking_time=rnd.randint(5, 180),
+        ))
+        for ingredient_id in _pick(
+                rnd, ingredients, ingredient_weights,
+                rnd.randint(MIN_INGREDIENTS, MAX_INGREDIENTS)):
+            items.append(RecipeIngredient(
+                recipe_id=pk, ingredient_id=ingredient_id,
+                amount=rnd.randint(1, 500),
+                measurement_unit=units[ingredient_id]))
+        for tag_id in rnd.sample(plan["tags"],
+                                 rnd.randint(1, min(MAX_TAGS,
+                                                    len(plan["tags"])))):
+            tags.append(through(recipes_id=pk, tag_id=tag_id))
+    with transaction.atomic():
+        Recipes.objects.bulk_create(recipes, batch_size=BATCH_SIZE)
+        RecipeIngredient.objects.bulk_create(items, batch_size=BATCH_SIZE)
+        through.objects.bulk_create(tags, batch_size=BATCH_SIZE)
+    return len(recipes) + len(items) + len(tags)
+
+
+def _seed_relations(plan, kind, first, last):
+    """Подписки, избранное или корзины пользователей first..last."""
+    model, field, targets = {
+        "follows": (Follow, "author_id", ("first_user", "users")),
+        "favorites": (Favorites, "recipe_id", ("first_recipe", "recipes")),
+        "carts": (Basket, "recipe_id", ("first_recipe", "recipes")),
+    }[kind]
+    rnd = _random(plan["seed"], kind, first)
+    ids, weights = _popularity(plan["seed"], f"{kind} targets",
+                               plan[targets[0]], plan[targets[1]])
+    counts = plan[kind]
+    rows = [
+        model(user_id=user_id, **{field: target})
+        for user_id in range(first, last)
+        for target in _pick(
+            rnd, ids, weights,
+            counts[user_id - plan["first_user"]],
+            exclude=user_id if kind == "follows" else None)
+    ]
+    with transaction.atomic():
+        model.objects.bulk_create(rows, batch_size=BATCH_SIZE,
+                                  ignore_conflicts=True)
+    return len(rows)
+
+
+def _run(task):
+    name, args = task
+    if name == "recipes":
+        return _seed_recipes(*args)
+    return _seed_relations(*args)
+
+
+def _chunks(first, count, size):
+    for start in range(first, first + count, size):
+        yield start, min(start + size, first + count)
+
+
+class Seeder:
+    """Заполняет базу данными размеров sizes (см. SIZES).
+
+    workers > 1 распределяет пачки по процессам; SQLite пишет только в
+    одном процессе, поэтому для него имеет смысл workers=1.
+    """
+
+    def __init__(self, sizes, seed=0, workers=1, password=PASSWORD,
+                 log=None):
+        self.sizes = sizes
+        self.seed = seed
+        self.workers = workers
+        self.password = password
+        self.log = log or (lambda message: None)
+        self.rows = {}
+        self.seconds = 0.0
+
+    def _next_id(self, model):
+        last = model.objects.order_by("-pk").values_list(
+            "pk", flat=True).first()
+        return (last or 0) + 1
+
+    def _tags(self):
+        Tag.objects.bulk_create(
+            [Tag(name=name, color=color, slug=slug)
+             for name, color, slug in TAGS],
+            ignore_conflicts=True)
+        cache.invalidate("tags")
+        return sorted(Tag.objects.values_list("pk", flat=True))
+
+    def _users(self, first):
+        password = make_password(self.password)
+        users = [
+            User(pk=pk, username=f"seed{pk}", email=f"seed{pk}@example.com",
+                 first_name=f"Имя{pk}", last_name=f"Фамилия{pk}",
+                 password=password)
+            for pk in range(first, first + self.sizes["users"])
+        ]
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+        return len(users)
+
+    def _reset_sequences(self):
+        """После вставки с явными ключами сдвинуть счетчики (PostgreSQL)."""
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [User, Recipes])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def _map(self, tasks):
+        if self.workers <= 1:
+            return sum(map(_run, tasks))
+        # Каждый процесс откроет свое соединение с базой.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            return sum(pool.map(_run, tasks))
+
+    def _stage(self, name, tasks):
+        started = time.monotonic()
+        self.rows[name] = self._map(tasks)
+        self.log(f"{name}: {self.rows[name]} строк за "
+                 f"{time.monotonic() - started:.1f} с")
+
+    def run(self):
+        units = dict(Ingredient.objects.values_list("pk", "measurement_unit"))
+        if not units:
+            raise ValueError("Справочник ингредиентов пуст")
+        sizes = self.sizes
+        plan = {
+            "seed": self.seed,
+            "first_user": self._next_id(User),
+            "first_recipe": self._next_id(Recipes),
+            "users": sizes["users"],
+            "recipes": sizes["recipes"],
+            "tags": self._tags(),
+            "units": units,
+        }
+        ingredient_ids = sorted(units)
+        order, weights = _popularity(self.seed, "ingredients", 0, len(units))
+        plan["ingredients"] = ([ingredient_ids[i] for i in order], weights)
+        for kind, targets in (("follows", "users"), ("favorites", "recipes"),
+                              ("carts", "recipes")):
+            plan[kind] = activity(self.seed, kind, sizes["users"],
+                                  sizes[kind], sizes[targets] - 1)
+
+        started = time.monotonic()
+        self.rows["users"] = self._users(plan["first_user"])
+        self.log(f"users: {self.rows['users']} строк за "
+                 f"{time.monotonic() - started:.1f} с")
+        self._stage("recipes", [
+            ("recipes", (plan, first, last)) for first, last in _chunks(
+                plan["first_recipe"], sizes["recipes"], RECIPES_PER_TASK)])
+        self._reset_sequences()
+        for kind in ("follows", "favorites", "carts"):
+            self._stage(kind, [
+                ("relations", (plan, kind, first, last))
+                for first, last in _chunks(
+                    plan["first_user"], sizes["users"], USERS_PER_TASK)])
+        stage = time.monotonic()
+        shopping_list.rebuild(User.objects.filter(
+            pk__gte=plan["first_user"]).values("pk"))
+        self.log(f"списки покупок за {time.monotonic() - stage:.1f} с")
+        self.seconds = time.monotonic() - started
+        return self.rows
@@ -2,13 +2,17 @@ import base64
 
 from django.contrib.auth.models import AnonymousUser
 from django.core.files.base import ContentFile
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 
 
 from users.models import User
 
+from . import images, shopping_list, uploads
+from .relations import user_relations
 from .models import (
     Basket,
     Favorites,
@@ -24,14 +28,40 @@ MAX_AMOUNT: int = 32000
 
 
 class Base64ImageField(serializers.ImageField):
+    """Файл multipart, строка base64 или "upload:<токен>"."""
+
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith("data:image"):
+        if isinstance(data, str) and data.startswith(uploads.TOKEN_PREFIX):
+            request = self.context["request"]
+            try:
+                data = uploads.open_upload(
+                    request.user, data[len(uploads.TOKEN_PREFIX):])
+            except NotFound as error:
+                raise serializers.ValidationError(error.detail)
+            # Файл нужен до сохранения рецепта; закроет его
+            # HttpRequest.close() вместе с остальными загрузками запроса.
+            request._request.FILES.appendlist(self.field_name, data)
+        elif isinstance(data, str) and data.startswith("data:image"):
             format, imgstr = data.split(";base64,")
             ext = format.split("/")[-1]
 
             data = ContentFile(base64.b64decode(imgstr), name="temp." + ext)
 
-        return super().to_internal_value(data)
+        return images.normalize(super().to_internal_value(data))
+
+
+class RelationsListSerializer(serializers.ListSerializer):
+    """Ограничивает загрузку связей пользователя объектами страницы."""
+
+    def to_representation(self, data):
+        items = data.all() if hasattr(data, "all") else data
+        items = list(items)
+        request = self.context.get("request")
+        if request is not None and items:
+            limit = getattr(self.child, "limit_relations", None)
+            if limit is not None:
+                limit(user_relations(request), items)
+        return super().to_representation(items)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -50,6 +80,11 @@ class UserSerializer(serializers.ModelSerializer):
             "password",
         )
         read_only_fields = ("id",)
+        list_serializer_class = RelationsListSerializer
+
+    @staticmethod
+    def limit_relations(relations, users):
+        relations.limit_to(author_ids=[user.pk for user in users])
 
     def create(self, validated_data):
         user = User.objects.create(
@@ -71,7 +106,10 @@ class UserSerializer(serializers.ModelSerializer):
         if isinstance(current_user, AnonymousUser):
             return False
 
-        return obj.follower.filter(user=current_user).exists()
+        if hasattr(obj, "subscribed"):
+            return obj.subscribed
+
+        return user_relations(self.context["request"]).is_subscribed(obj.pk)
 
 
 class UserMeSerializer(serializers.ModelSerializer):
@@ -94,6 +132,11 @@ class UserMeSerializer(serializers.ModelSerializer):
             "is_subscribed",
             "password",
         )
+        list_serializer_class = RelationsListSerializer
+
+    @staticmethod
+    def limit_relations(relations, users):
+        relations.limit_to(author_ids=[user.pk for user in users])
 
     def get_is_subscribed(self, obj):
         current_user = self.context["request"].user
@@ -101,7 +144,10 @@ class UserMeSerializer(serializers.ModelSerializer):
         if isinstance(current_user, AnonymousUser):
             return False
 
-        return obj.follower.filter(user=current_user).exists()
+        if hasattr(obj, "subscribed"):
+            return obj.subscribed
+
+        return user_relations(self.context["request"]).is_subscribed(obj.pk)
 
     def to_representation(self, instance):
         rep = super().to_representation(instance)
@@ -137,11 +183,11 @@ class TagSerializer(serializers.ModelSerializer):
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
-        fields = "__all__"
+        exclude = ("name_search",)
 
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.ReadOnlyField(source="ingredient.id")
+    id = serializers.IntegerField(source="ingredient_id")
     name = serializers.ReadOnlyField(source="ingredient.name")
     measurement_unit = serializers.ReadOnlyField(
         source="ingredient.measurement_unit")
@@ -160,10 +206,34 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         )
 
 
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """ManyRelatedField, загружающий все объекты одним запросом."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, "__iter__"):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail("empty")
+        pks = []
+        for pk in data:
+            try:
+                pks.append(int(pk))
+            except (TypeError, ValueError):
+                self.child_relation.fail("incorrect_type",
+                                         data_type=type(pk).__name__)
+        pks = list(dict.fromkeys(pks))
+        objects = self.child_relation.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                self.child_relation.fail("does_not_exist", pk_value=pk)
+        return [objects[pk] for pk in pks]
+
+
 class RecipesSerializer(serializers.ModelSerializer):
     author = UserMeSerializer(many=False, required=False)
-    tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                              many=True)
+    tags = BulkManyRelatedField(
+        child_relation=serializers.PrimaryKeyRelatedField(
+            queryset=Tag.objects.all()))
     ingredients = RecipeIngredientSerializer(many=True,
                                              source="recipe_ingredients")
     is_favorited = serializers.SerializerMethodField()
@@ -174,79 +244,137 @@ class RecipesSerializer(serializers.ModelSerializer):
     )
 
     image = Base64ImageField()
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipes
-        fields = "__all__"
+        exclude = ("search_vector", "updated_at")
         read_only_fields = (
             "id",
             "is_favorited",
             "is_in_shopping_cart",
         )
+        list_serializer_class = RelationsListSerializer
+
+    @staticmethod
+    def limit_relations(relations, recipes):
+        relations.limit_to(
+            recipe_ids=[recipe.pk for recipe in recipes],
+            author_ids=[recipe.author_id for recipe in recipes],
+        )
+
+    def get_images(self, obj):
+        return images.rendition_urls(obj.image, self.context.get("request"))
 
     def get_is_favorited(self, obj):
         user = self.context["request"].user
-        return obj.is_favorite_for_user(user)
+        if not user.is_authenticated:
+            return False
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
+        return user_relations(self.context["request"]).is_favorited(obj.pk)
 
     def get_is_in_shopping_cart(self, obj):
         user = self.context["request"].user
-        return obj.is_in_shopping_cart_for_user(user)
-
+        if not user.is_authenticated:
+            return False
+        if hasattr(obj, "is_in_shopping_cart"):
+            return obj.is_in_shopping_cart
+        return user_relations(
+            self.context["request"]).is_in_shopping_cart(obj.pk)
+
+    def validate_ingredients(self, ingredients):
+        ids = [item["ingredient_id"] for item in ingredients]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError(
+                "Ингредиенты не должны повторяться.")
+        missing = set(ids) - set(
+            Ingredient.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                f"Ингредиенты не найдены: {sorted(missing)}.")
+        return ingredients
+
+    def _set_tags(self, recipe, tags, created=False):
+        through = Recipes.tags.through
+        current = set() if created else set(
+            through.objects.filter(recipes=recipe)
+            .values_list("tag_id", flat=True))
+        wanted = {tag.pk for tag in tags}
+        if current - wanted:
+            through.objects.filter(
+                recipes=recipe, tag_id__in=current - wanted).delete()
+        through.objects.bulk_create([
+            through(recipes=recipe, tag_id=tag_id)
+            for tag_id in wanted - current
+        ])
+
+    def _set_ingredients(self, recipe, ingredients, created=False):
+        """Привести состав к ingredients; возвращает изменения количеств."""
+        current = {} if created else {
+            row.ingredient_id: row
+            for row in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        wanted = {item["ingredient_id"]: item["amount"]
+                  for item in ingredients}
+        deltas = {}
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = wanted.get(ingredient_id, 0)
+            if amount != row.amount:
+                deltas[ingredient_id] = amount - row.amount
+                if amount:
+                    row.amount = amount
+                    changed.append(row)
+        removed = current.keys() - wanted.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        RecipeIngredient.objects.bulk_update(changed, ["amount"])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in wanted.items()
+            if ingredient_id not in current
+        ])
+        for ingredient_id in wanted.keys() - current.keys():
+            deltas[ingredient_id] = wanted[ingredient_id]
+        return deltas
+
+    @transaction.atomic
     def create(self, validated_data):
         tags_data = validated_data.pop("tags")
         ingredients_data = validated_data.pop("recipe_ingredients")
         recipe = Recipes.objects.create(**validated_data)
-        recipe.tags.set(tags_data)
-
-        recipe_ingredients = []
-        for ingredient_data in ingredients_data:
-            ingredient_id = ingredient_data.get("id")
-            amount = ingredient_data.get("amount")
-            if ingredient_id and amount:
-                recipe_ingredients.append(RecipeIngredient(
-                    recipe=recipe,
-                    ingredient_id=ingredient_id,
-                    amount=amount,
-                ))
-
-        RecipeIngredient.objects.bulk_create(recipe_ingredients)
-
+        self._set_tags(recipe, tags_data, created=True)
+        self._set_ingredients(recipe, ingredients_data, created=True)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags_data = validated_data.pop("tags")
-        ingredients_data = validated_data.pop("recipe_ingredients")
+        tags_data = validated_data.pop("tags", None)
+        ingredients_data = validated_data.pop("recipe_ingredients", None)
 
         instance.name = validated_data.get("name", instance.name)
         instance.cooking_time = validated_data.get("cooking_time",
                                                    instance.cooking_time)
         instance.text = validated_data.get("text", instance.text)
-
-        instance.tags.set(tags_data)
+        instance.image = validated_data.get("image", instance.image)
         instance.save()
 
-        for ingredient_data in ingredients_data:
-            ingredient_id = ingredient_data.get("id")
-            amount = ingredient_data.get("amount")
-            if ingredient_id and amount:
-                try:
-                    recipe_ingredient = RecipeIngredient.objects.get(
-                        recipe=instance, ingredient_id=ingredient_id
-                    )
-                    recipe_ingredient.amount = amount
-                    recipe_ingredient.save()
-                except RecipeIngredient.DoesNotExist:
-                    pass
-        new_ingredients_to_create = [
-            RecipeIngredient(recipe=instance, ingredient_id=data["id"],
-                             amount=data["amount"])
-            for data in ingredients_data if "id" in data and "amount" in data
-        ]
-        RecipeIngredient.objects.bulk_create(new_ingredients_to_create)
+        if tags_data is not None:
+            self._set_tags(instance, tags_data)
+        if ingredients_data is not None:
+            shopping_list.change_recipe(
+                instance.pk, self._set_ingredients(instance, ingredients_data))
+        # Предзагруженные теги и состав устарели.
+        getattr(instance, "_prefetched_objects_cache", {}).clear()
 
         return instance
 
     def to_representation(self, instance):
+        if hasattr(instance, "author_subscribed"):
+            instance.author.subscribed = instance.author_subscribed
         rep = super().to_representation(instance)
         tags_data = []
         for tag in instance.tags.all():
@@ -262,10 +390,14 @@ class RecipesSerializer(serializers.ModelSerializer):
 
 
 class BasketSerializer(serializers.ModelSerializer):
-    id = serializers.IntegerField(required=False)
     recipe = serializers.PrimaryKeyRelatedField(queryset=Recipes.objects.all())
     image = serializers.SerializerMethodField()
-    cooking_time = serializers.IntegerField()
+    cooking_time = serializers.ReadOnlyField(source="recipe.cooking_time")
+    quantity = serializers.IntegerField(
+        min_value=MIN_AMOUNT,
+        max_value=MAX_AMOUNT,
+        default=1
+    )
 
     class Meta:
         model = Basket
@@ -274,39 +406,39 @@ class BasketSerializer(serializers.ModelSerializer):
             "recipe",
             "image",
             "cooking_time",
+            "quantity",
         )
 
     def get_image(self, obj):
         return obj.recipe.image.url if obj.recipe.image else None
 
+    @transaction.atomic
     def create(self, validated_data):
-        request = self.context.get('request')
-        recipe = self.context.get('recipe')
-        quantity = self.context.get('quantity', 1)
-        cooking_time = self.context.get('cooking_time', 0)
-
-        basket_items = []
-        for ingredient in recipe.ingredients.all():
-            basket_item = Basket(
-                recipe=recipe,
-                user=request.user,
-                quantity=quantity,
-                cooking_time=cooking_time,
-                image=recipe.image,
-                ingredient=ingredient,
-            )
-            basket_items.append(basket_item)
-
-        Basket.objects.bulk_create(basket_items)
-        return validated_data
+        quantity = validated_data["quantity"]
+        basket, created = Basket.objects.select_for_update().get_or_create(
+            user=self.context["request"].user,
+            recipe=validated_data["recipe"],
+            defaults={"quantity": quantity},
+        )
+        added = quantity if created else quantity - basket.quantity
+        if not created and added:
+            basket.quantity = quantity
+            basket.save(update_fields=["quantity"])
+        shopping_list.add_recipe(basket.user_id, basket.recipe_id, added)
+        return basket
 
 
 class FavoritesSerializer(serializers.ModelSerializer):
-    recipes = serializers.SerializerMethodField()
+    """Краткая карточка рецепта, добавленного в избранное."""
+
+    id = serializers.ReadOnlyField(source="recipe.id")
+    name = serializers.ReadOnlyField(source="recipe.name")
+    image = serializers.ImageField(source="recipe.image", read_only=True)
+    cooking_time = serializers.ReadOnlyField(source="recipe.cooking_time")
 
     class Meta:
         model = Favorites
-        fields = ("recipes",)
+        fields = ("id", "name", "image", "cooking_time")
 
     def create(self, validated_data):
         recipe_id = self.context["view"].kwargs["recipe_id"]
@@ -316,13 +448,6 @@ class FavoritesSerializer(serializers.ModelSerializer):
             recipe=recipe,)
         return favorites
 
-    def get_recipes(self, favorites):
-        author_recipes = favorites.recipe.author.recipes.all()
-        context = self.context.copy()
-        context["request"] = self.context["request"]
-        return CustomRecipesSerializer(author_recipes, many=True,
-                                       context=context).data
-
 
 class CustomRecipesSerializer(serializers.ModelSerializer):
     class Meta:
@@ -331,6 +456,13 @@ class CustomRecipesSerializer(serializers.ModelSerializer):
 
 
 class AuthorSerializer(serializers.ModelSerializer):
+    """Автор в подписке.
+
+    Рецепты берутся из context["author_recipes"] ({id автора: рецепты}),
+    который FollowViewSet заполняет одним запросом на страницу, а
+    recipes_count — из аннотации.
+    """
+
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
 
@@ -339,47 +471,33 @@ class AuthorSerializer(serializers.ModelSerializer):
         fields = ("id", "recipes", "recipes_count", "first_name", "last_name")
 
     def get_recipes(self, user):
-        user_recipes = user.recipes.all()
-        context = self.context.copy()
-        context["request"] = self.context["request"]
+        user_recipes = self.context.get("author_recipes", {}).get(user.pk)
+        if user_recipes is None:
+            user_recipes = user.recipes.all()
         return CustomRecipesSerializer(user_recipes, many=True,
-                                       context=context).data
+                                       context=self.context).data
 
     def get_recipes_count(self, user):
+        if hasattr(user, "recipes_count"):
+            return user.recipes_count
         return user.recipes.count()
 
 
 class FollowSerializer(serializers.ModelSerializer):
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
     author = AuthorSerializer(many=False, read_only=True)
 
     class Meta:
         model = Follow
         fields = '__all__'
 
-    def get_recipes(self, follow):
-        user_recipes = follow.user.recipes.all()
-        context = self.context.copy()
-        context["request"] = self.context["request"]
-        return CustomRecipesSerializer(user_recipes, many=True,
-                                       context=context).data
-
-    def get_recipes_count(self, follow):
-        return follow.user.recipes.count()
-
     def to_representation(self, instance):
-        rep = super().to_representation(instance)
-        rep['id'] = instance.user.id
-
         author = instance.author
-        user_recipes = author.recipes.all()
-        context = self.context.copy()
-        context["request"] = self.context["request"]
-        rep['recipes'] = CustomRecipesSerializer(user_recipes, many=True,
-                                                 context=context).data
-        rep['recipes_count'] = author.recipes.count()
-
+        if hasattr(instance, "recipes_count"):
+            author.recipes_count = instance.recipes_count
+        rep = super().to_representation(instance)
+        rep['id'] = instance.user_id
+        rep['recipes'] = rep['author']['recipes']
+        rep['recipes_count'] = rep['author']['recipes_count']
         rep['first_name'] = author.first_name
         rep['last_name'] = author.last_name
 
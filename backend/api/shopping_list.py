@@ -0,0 +1,180 @@
+"""Список покупок: суммарное количество ингредиентов из корзины.
+
+Итоги хранятся в ShoppingListItem и обновляются инкрементально через F():
+add_recipe() — при добавлении, удалении и изменении количества рецепта в
+корзине, change_recipe() — при изменении состава рецепта. rebuild()
+пересчитывает итоги с нуля по корзинам.
+"""
+import csv
+
+from django.db import connection, transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+
+from .models import Basket, Ingredient, RecipeIngredient, ShoppingListItem
+
+CHUNK_SIZE: int = 500
+BATCH_SIZE: int = 1000
+THANKS_MESSAGE = "Спасибо что пользуетесь нашим сервисом!"
+
+
+def shopping_list(user):
+    """Список покупок пользователя: одно чтение по индексу (user, ...)."""
+    return ShoppingListItem.objects.filter(
+        user=user, total__gt=0,
+    ).values(
+        "total", name=F("ingredient__name"), unit=F("measurement_unit"),
+    ).order_by("name")
+
+
+def expected_totals(users=None):
+    """Итоги, посчитанные по корзинам одним сгруппированным запросом.
+
+    SUM(количество рецепта в корзине × количество ингредиента в рецепте)
+    с группировкой по пользователю, ингредиенту и единице измерения.
+    """
+    # Условия в одном filter(), чтобы корзины присоединялись один раз.
+    lookups = {"recipe__baskets__isnull": False}
+    if users is not None:
+        lookups["recipe__baskets__user__in"] = users
+    return RecipeIngredient.objects.filter(**lookups).values(
+        "ingredient_id",
+        user_id=F("recipe__baskets__user_id"),
+        unit=F("ingredient__measurement_unit"),
+    ).annotate(
+        total=Sum(F("amount") * F("recipe__baskets__quantity")),
+    ).order_by()
+
+
+def recipe_amounts(recipe_id):
+    """Количество каждого ингредиента в рецепте: {ingredient_id: amount}."""
+    return dict(
+        RecipeIngredient.objects.filter(recipe_id=recipe_id)
+        .values("ingredient_id").annotate(amount=Sum("amount"))
+        .values_list("ingredient_id", "amount").order_by()
+    )
+
+
+def amount_deltas(before, after):
+    """Разница между двумя результатами recipe_amounts()."""
+    return {
+        ingredient_id: after.get(ingredient_id, 0)
+        - before.get(ingredient_id, 0)
+        for ingredient_id in before.keys() | after.keys()
+    }
+
+
+def _create_missing(user_ids, ingredient_ids):
+    units = dict(Ingredient.objects.filter(
+        pk__in=ingredient_ids).values_list("pk", "measurement_unit"))
+    ShoppingListItem.objects.bulk_create(
+        [
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             measurement_unit=units[ingredient_id])
+            for user_id in user_ids for ingredient_id in units
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def _delete_empty(items):
+    items.filter(total__lte=0).delete()
+
+
+@transaction.atomic
+def add_recipe(user_id, recipe_id, quantity):
+    """Учесть quantity (может быть отрицательным) порций рецепта."""
+    if not quantity:
+        return
+    amounts = recipe_amounts(recipe_id)
+    if not amounts:
+        return
+    if quantity > 0:
+        _create_missing([user_id], amounts)
+    items = ShoppingListItem.objects.filter(
+        user_id=user_id, ingredient_id__in=amounts)
+    items.update(total=F("total") + Case(
+        *[When(ingredient_id=ingredient_id, then=Value(amount * quantity))
+          for ingredient_id, amount in amounts.items()],
+        default=Value(0),
+    ))
+    if quantity < 0:
+        _delete_empty(items)
+
+
+@transaction.atomic
+def change_recipe(recipe_id, deltas):
+    """Учесть изменение состава рецепта во всех корзинах с ним.
+
+    deltas — {ingredient_id: изменение количества в рецепте}.
+    """
+    deltas = {key: value for key, value in deltas.items() if value}
+    baskets = Basket.objects.filter(recipe_id=recipe_id)
+    if not deltas or not baskets.exists():
+        return
+    added = [key for key, value in deltas.items() if value > 0]
+    if added:
+        _create_missing(baskets.values_list("user_id", flat=True), added)
+    quantity = Subquery(
+        baskets.filter(user_id=OuterRef("user_id")).values("quantity")[:1])
+    items = ShoppingListItem.objects.filter(
+        user__in=baskets.values("user_id"), ingredient_id__in=deltas)
+    items.update(total=F("total") + quantity * Case(
+        *[When(ingredient_id=ingredient_id, then=Value(delta))
+          for ingredient_id, delta in deltas.items()],
+        default=Value(0),
+    ))
+    if len(added) < len(deltas):
+        _delete_empty(items)
+
+
+@transaction.atomic
+def rebuild(users=None):
+    """Пересобрать итоги с нуля для users (или для всех пользователей)."""
+    items = ShoppingListItem.objects.all()
+    if users is not None:
+        items = items.filter(user__in=users)
+    items.delete()
+    # Итоги переносятся одним INSERT ... SELECT внутри базы, без
+    # создания объектов на каждую строку.
+    sql, params = expected_totals(users).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {ShoppingListItem._meta.db_table} "
+            f"(user_id, ingredient_id, measurement_unit, total) "
+            f"SELECT user_id, ingredient_id, unit, total "
+            f"FROM ({sql}) totals WHERE total > 0",
+            params,
+        )
+
+
+def rebuild_for_recipes(recipe_ids):
+    """Пересобрать итоги пользователей, у которых рецепты в корзине."""
+    rebuild(Basket.objects.filter(
+        recipe_id__in=recipe_ids).values("user_id"))
+
+
+def iter_txt(items):
+    for item in items.iterator(chunk_size=CHUNK_SIZE):
+        yield f"{item['name']} {item['total']} {item['unit']}\n"
+    yield THANKS_MESSAGE
+
+
+class _Echo:
+    """Буфер для csv.writer, который сразу отдает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(items):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(("name", "total", "measurement_unit"))
+    for item in items.iterator(chunk_size=CHUNK_SIZE):
+        yield writer.writerow((item["name"], item["total"], item["unit"]))
+
+
+FORMATS = {
+    "txt": ("text/plain; charset=utf-8", iter_txt),
+    "csv": ("text/csv; charset=utf-8", iter_csv),
+}
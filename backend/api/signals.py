@@ -0,0 +1,141 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import cache, images, shopping_list
+from .models import (Basket, DeletedRecipe, Ingredient, RecipeIngredient,
+                     Recipes, ShoppingListItem, Tag)
+
+
+def _deleted_directly(origin, model):
+    """Удаление начато с самой модели, а не каскадом от другой."""
+    return isinstance(origin, model) or (
+        isinstance(origin, QuerySet) and origin.model is model)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    cache.invalidate("tags")
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    cache.invalidate("ingredients")
+
+
+@receiver(post_save, sender=Ingredient)
+def update_shopping_list_unit(sender, instance, created, **kwargs):
+    if not created:
+        ShoppingListItem.objects.filter(ingredient=instance).update(
+            measurement_unit=instance.measurement_unit)
+
+
+@receiver(pre_delete, sender=Basket)
+def remove_basket_from_shopping_list(sender, instance, origin=None,
+                                     **kwargs):
+    # Каскадное удаление из-за рецепта учитывает
+    # remove_recipe_from_shopping_lists, а список покупок удаленного
+    # пользователя удаляется каскадом сам.
+    if _deleted_directly(origin, Basket):
+        shopping_list.add_recipe(instance.user_id, instance.recipe_id,
+                                 -instance.quantity)
+
+
+@receiver(pre_delete, sender=Recipes)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    shopping_list.change_recipe(instance.pk, {
+        ingredient_id: -amount for ingredient_id, amount
+        in shopping_list.recipe_amounts(instance.pk).items()
+    })
+
+
+@receiver(pre_save, sender=Recipes)
+def remember_recipe_image(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._previous_image = Recipes.objects.filter(
+            pk=instance.pk).values_list("image", flat=True).first()
+
+
+@receiver(post_save, sender=Recipes)
+def render_recipe_image(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.image:
+        transaction.on_commit(partial(images.schedule, instance.image.name))
+    previous = getattr(instance, "_previous_image", None)
+    if previous and previous != instance.image.name:
+        transaction.on_commit(partial(images.release, previous))
+
+
+@receiver(post_delete, sender=Recipes)
+def release_recipe_image(sender, instance, **kwargs):
+    if instance.image:
+        transaction.on_commit(partial(images.release, instance.image.name))
+
+
+@receiver(post_delete, sender=Recipes)
+def remember_deleted_recipe(sender, instance, **kwargs):
+    DeletedRecipe.objects.create(recipe_id=instance.pk)
+
+
+# Изменения состава и тегов в обход RecipesSerializer (админка, shell)
+# тоже должны попасть в инкрементальную выгрузку: рецепт отмечается
+# измененным через updated_at.
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_ingredient_recipe(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._previous_recipe_id = RecipeIngredient.objects.filter(
+            pk=instance.pk).values_list("recipe_id", flat=True).first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def touch_recipe_on_ingredient_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Recipes.objects.filter(pk__in={
+            instance.recipe_id,
+            getattr(instance, "_previous_recipe_id", instance.recipe_id),
+        }).touch()
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def touch_recipe_on_ingredient_delete(sender, instance, origin=None,
+                                      **kwargs):
+    # Каскад от рецепта не нужен, от ингредиента - учтен в
+    # touch_recipes_on_ingredient_change.
+    if _deleted_directly(origin, RecipeIngredient):
+        Recipes.objects.filter(pk=instance.recipe_id).touch()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_recipes_on_ingredient_change(sender, instance, created=False,
+                                       raw=False, **kwargs):
+    if not created and not raw:
+        Recipes.objects.filter(
+            recipe_ingredients__ingredient=instance).touch()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_recipes_on_tag_change(sender, instance, created=False, raw=False,
+                                **kwargs):
+    if not created and not raw:
+        Recipes.objects.filter(tags=instance).touch()
+
+
+@receiver(m2m_changed, sender=Recipes.tags.through)
+def touch_recipes_on_tags_change(sender, instance, action, reverse, pk_set,
+                                 **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        Recipes.objects.filter(pk=instance.pk).touch()
+    elif action == "pre_clear":
+        Recipes.objects.filter(tags=instance).touch()
+    else:
+        Recipes.objects.filter(pk__in=pk_set).touch()
@@ -0,0 +1,104 @@
+"""Хранение изображений рецептов по хешу содержимого.
+
+Файл называется sha256 своего содержимого и лежит во вложенных
+каталогах по первым символам хеша: api/media/3f/a2/3fa2....jpg.
+Расширение берется по формату, который определил Pillow, а не из имени
+загрузки, поэтому одинаковые загрузки хранятся один раз; файл
+удаляется, когда на него не ссылается ни один рецепт (images.release).
+"""
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from PIL import Image, UnidentifiedImageError
+
+SHARD_DEPTH: int = 2
+SHARD_WIDTH: int = 2
+HASHED_NAME = re.compile(
+    r"(^|/)" + r"[0-9a-f]{%d}/" % SHARD_WIDTH * SHARD_DEPTH
+    + r"(?P<digest>[0-9a-f]{64})(\.\w+)?$"
+)
+EXTENSIONS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "GIF": ".gif",
+    "WEBP": ".webp",
+}
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def image_extension(content):
+    """Расширение по формату изображения, None - если это не картинка."""
+    content.seek(0)
+    try:
+        image_format = Image.open(content).format
+    except (UnidentifiedImageError, OSError):
+        return None
+    finally:
+        content.seek(0)
+    return EXTENSIONS.get(image_format, f".{image_format.lower()}")
+
+
+def hashed_name(name, digest, extension=None):
+    """Имя файла для содержимого с хешем digest в каталоге name."""
+    directory, filename = posixpath.split(name)
+    if extension is None:
+        extension = posixpath.splitext(filename)[1].lower()
+    shards = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH]
+              for i in range(SHARD_DEPTH)]
+    return posixpath.join(directory, *shards, digest + extension)
+
+
+def is_hashed(name):
+    return bool(HASHED_NAME.search(name))
+
+
+class _AlreadyStored(Exception):
+    pass
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, сохраняющий файлы под хешем содержимого."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = hashed_name(name, content_hash(content),
+                           image_extension(content))
+        try:
+            return super().save(name, content, max_length)
+        except _AlreadyStored:
+            # Время изменения - признак того, что файл только что снова
+            # понадобился (см. images.release).
+            os.utime(self.path(name))
+            return name
+
+    def get_available_name(self, name, max_length=None):
+        # Совпадение хеша означает тот же файл: вместо суффикса
+        # прерываем сохранение. Сюда же попадает гонка двух одинаковых
+        # загрузок внутри FileSystemStorage._save.
+        if self.exists(name):
+            raise _AlreadyStored
+        return name
+
+
+content_storage = ContentAddressedStorage()
+
+
+def get_content_storage():
+    return content_storage
@@ -0,0 +1,529 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from io import BytesIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from . import export, images, uploads
+from .shopping_list import expected_totals, rebuild
+from .management.commands.check_query_plans import FULL_SCAN, explain_plans
+from .models import (Basket, Favorites, Ingredient, RecipeIngredient, Recipes,
+                     ShoppingListItem, Tag)
+from .parsers import MultiPartJSONParser
+from .storage import content_storage
+from users.models import User
+
+RECIPES: int = 10
+
+
+class RecipeListQueriesTest(APITestCase):
+    """Число SQL-запросов списка рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, author = [
+            User.objects.create(username=name, email=f"{name}@example.com",
+                                first_name=name, last_name=name)
+            for name in ("user", "author")
+        ]
+        tags = [Tag.objects.create(name=f"Тег {i}", color="#FFFFFF",
+                                   slug=f"tag{i}") for i in range(3)]
+        ingredients = [Ingredient.objects.create(name=f"Ингредиент {i}",
+                                                 measurement_unit="г")
+                       for i in range(3)]
+        for i in range(RECIPES):
+            recipe = Recipes.objects.create(
+                author=author, name=f"Рецепт {i}", text="Текст",
+                cooking_time=10)
+            recipe.tags.set(tags[:i % 3 + 1])
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=100, measurement_unit="г")
+                for ingredient in ingredients
+            ])
+            if i % 2:
+                Favorites.objects.create(user=cls.user, recipe=recipe)
+                Basket.objects.create(user=cls.user, recipe=recipe)
+
+    def assert_queries(self, expected, query):
+        for limit in (1, RECIPES):
+            with self.subTest(query=query, limit=limit):
+                with self.assertNumQueries(expected):
+                    response = self.client.get(
+                        f"/api/recipes/?limit={limit}{query}")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data["results"]), limit)
+
+    def test_anonymous(self):
+        self.assert_queries(3, "")
+        # Постраничная навигация добавляет COUNT(*).
+        self.assert_queries(4, "&page=1")
+
+    def test_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_queries(3, "")
+        self.assert_queries(4, "&page=1")
+
+    def test_authenticated_flags(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f"/api/recipes/?limit={RECIPES}")
+        favorited = {recipe["name"] for recipe in response.data["results"]
+                     if recipe["is_favorited"]}
+        in_cart = {recipe["name"] for recipe in response.data["results"]
+                   if recipe["is_in_shopping_cart"]}
+        expected = {f"Рецепт {i}" for i in range(1, RECIPES, 2)}
+        self.assertEqual(favorited, expected)
+        self.assertEqual(in_cart, expected)
+
+
+class QueryPlansTest(TestCase):
+    """Частые запросы к таблицам связей используют индексы."""
+
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor not in FULL_SCAN:
+            self.skipTest(f"EXPLAIN для {connection.vendor} не разбирается")
+        author = User.objects.create(username="author",
+                                     email="author@example.com")
+        recipe = Recipes.objects.create(author=author, name="Рецепт",
+                                        text="Текст", cooking_time=10)
+        ingredient = Ingredient.objects.create(name="Ингредиент",
+                                               measurement_unit="г")
+        for label, (plan, scans) in explain_plans(
+                author.pk, recipe.pk, ingredient.pk).items():
+            with self.subTest(label):
+                self.assertEqual(scans, [], plan)
+
+
+def image_bytes(image_format="PNG", color="red"):
+    buffer = BytesIO()
+    Image.new("RGB", (10, 10), color).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class TemporaryMediaMixin:
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media,
+                                     UPLOADS_ROOT=f"{media}/uploads")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class RecipeUploadTest(TemporaryMediaMixin, APITestCase):
+    """Создание рецепта с изображением из multipart и из загрузки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="user",
+                                       email="user@example.com")
+        cls.tag = Tag.objects.create(name="Тег", color="#FFFFFF", slug="tag")
+        cls.ingredient = Ingredient.objects.create(name="Ингредиент",
+                                                   measurement_unit="г")
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def recipe(self, **fields):
+        return {"name": "Рецепт", "text": "Текст", "cooking_time": 10,
+                **fields}
+
+    def test_multipart(self):
+        image = SimpleUploadedFile("photo.png", image_bytes(), "image/png")
+        parsed = []
+
+        def parse(*args, **kwargs):
+            parsed.append(parse.original(*args, **kwargs))
+            return parsed[-1]
+
+        parse.original = MultiPartJSONParser().parse
+        with mock.patch.object(MultiPartJSONParser, "parse",
+                               staticmethod(parse)):
+            response = self.client.post("/api/recipes/", self.recipe(
+                tags=[self.tag.pk], image=image,
+                ingredients=json.dumps([{"id": self.ingredient.pk,
+                                         "amount": 10}]),
+            ), format="multipart")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertTrue(Recipes.objects.get().image.name.endswith(".png"))
+        # Временные файлы закрываются в HttpRequest.close().
+        files = [file for _, values in parsed[0].files.lists()
+                 for file in values]
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].closed)
+
+    def test_chunked_upload_is_closed(self):
+        token = self.client.post("/api/uploads/").data["token"]
+        data = image_bytes()
+        response = self.client.generic(
+            "PATCH", f"/api/uploads/{token}/", data,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET="0")
+        self.assertEqual(response.data["offset"], len(data))
+        opened = []
+
+        def open_upload(*args):
+            opened.append(open_upload.original(*args))
+            return opened[-1]
+
+        open_upload.original = uploads.open_upload
+        with mock.patch.object(uploads, "open_upload", open_upload):
+            response = self.client.post("/api/recipes/", self.recipe(
+                tags=[self.tag.pk], image=uploads.TOKEN_PREFIX + token,
+                ingredients=[{"id": self.ingredient.pk, "amount": 10}],
+            ), format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+
+
+class IngredientAutocompleteTest(APITestCase):
+    """Подсказки ингредиентов не зависят от регистра, в том числе кириллицы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ("Соль", "Сахар", "Морская соль", "Salt"):
+            Ingredient.objects.create(name=name, measurement_unit="г")
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, prefix):
+        response = self.client.get("/api/ingredients/", {"name": prefix})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient["name"] for ingredient in response.json()]
+
+    def test_cyrillic_prefix(self):
+        for prefix in ("со", "Со", "СО"):
+            with self.subTest(prefix=prefix):
+                # Сначала начинающиеся с префикса, затем содержащие его.
+                self.assertEqual(self.names(prefix), ["Соль", "Морская соль"])
+
+    def test_latin_prefix(self):
+        self.assertEqual(self.names("sA"), ["Salt"])
+
+    def test_cache_key_normalized(self):
+        first = self.client.get("/api/ingredients/", {"name": "Со"})
+        # Тот же префикс в другом регистре и явный limit по умолчанию -
+        # ответ из кэша, без запросов к базе.
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/ingredients/",
+                                     {"name": "сО", "limit": "20"})
+        self.assertEqual(first.content, second.content)
+
+    def test_fields(self):
+        response = self.client.get("/api/ingredients/", {"name": "salt"})
+        self.assertEqual(set(response.json()[0]),
+                         {"id", "name", "measurement_unit"})
+
+    def test_rename(self):
+        ingredient = Ingredient.objects.get(name="Сахар")
+        ingredient.name = "Перец"
+        ingredient.save(update_fields=["name"])
+        self.assertEqual(self.names("пе"), ["Перец"])
+
+
+class ReleaseImagesTest(TemporaryMediaMixin, TestCase):
+    """Удаление изображений, на которые не ссылается ни один рецепт."""
+
+    def store(self, color, age=0):
+        name = content_storage.save("api/media/image.png",
+                                    ContentFile(image_bytes(color=color)))
+        modified = time.time() - age
+        os.utime(content_storage.path(name), (modified, modified))
+        return name
+
+    def test_release(self):
+        old = images.RELEASE_GRACE.total_seconds() + 1
+        author = User.objects.create(username="author",
+                                     email="author@example.com")
+        used = self.store("red", age=old)
+        Recipes.objects.create(author=author, name="Рецепт", text="Текст",
+                               cooking_time=10, image=used)
+        fresh = self.store("green")
+        unused = self.store("blue", age=old)
+        for name in (used, fresh, unused):
+            images.release(name)
+        self.assertTrue(content_storage.exists(used))
+        self.assertTrue(content_storage.exists(fresh))
+        self.assertFalse(content_storage.exists(unused))
+
+    def test_clean_images(self):
+        old = images.RELEASE_GRACE.total_seconds() + 1
+        fresh = self.store("green")
+        stale = [self.store(color, age=old) for color in ("red", "blue")]
+        stdout = io.StringIO()
+        call_command("clean_images", "--dry-run", stdout=stdout)
+        self.assertIn("Файлов: 3, к удалению: 2", stdout.getvalue())
+        self.assertTrue(all(map(content_storage.exists, stale)))
+        call_command("clean_images", stdout=io.StringIO())
+        self.assertTrue(content_storage.exists(fresh))
+        self.assertFalse(any(map(content_storage.exists, stale)))
+
+
+class ShoppingListTest(APITestCase):
+    """Итоги ShoppingListItem совпадают с пересчетом по корзинам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.user, cls.other = [
+            User.objects.create(username=name, email=f"{name}@example.com")
+            for name in ("author", "user", "other")
+        ]
+        cls.tag = Tag.objects.create(name="Тег", color="#FFFFFF", slug="tag")
+        cls.flour, cls.milk, cls.egg = [
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (("Мука", "г"), ("Молоко", "мл"),
+                               ("Яйцо", "шт"))
+        ]
+        cls.pancakes = cls.recipe("Блины", {cls.flour: 200, cls.milk: 500,
+                                            cls.egg: 2})
+        cls.omelette = cls.recipe("Омлет", {cls.milk: 100, cls.egg: 3})
+
+    @classmethod
+    def recipe(cls, name, amounts):
+        recipe = Recipes.objects.create(author=cls.author, name=name,
+                                        text="Текст", cooking_time=10)
+        recipe.tags.set([cls.tag])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in amounts.items()
+        ])
+        return recipe
+
+    def cart(self, user, recipe, quantity=None, method="post"):
+        self.client.force_authenticate(user)
+        data = {} if quantity is None else {"quantity": quantity}
+        response = getattr(self.client, method)(
+            f"/api/recipes/{recipe.pk}/shopping_cart/", data, format="json")
+        self.assertLess(response.status_code, 300, response.data)
+
+    def totals(self, user):
+        return dict(ShoppingListItem.objects.filter(user=user).values_list(
+            "ingredient__name", "total"))
+
+    def assert_consistent(self):
+        stored = set(ShoppingListItem.objects.values_list(
+            "user_id", "ingredient_id", "measurement_unit", "total"))
+        expected = {
+            (row["user_id"], row["ingredient_id"], row["unit"], row["total"])
+            for row in expected_totals() if row["total"] > 0
+        }
+        self.assertEqual(stored, expected)
+
+    def test_add(self):
+        self.cart(self.user, self.pancakes, 2)
+        self.cart(self.user, self.omelette)
+        self.cart(self.other, self.pancakes)
+        self.assertEqual(self.totals(self.user),
+                         {"Мука": 400, "Молоко": 1100, "Яйцо": 7})
+        self.assert_consistent()
+
+    def test_remove(self):
+        self.cart(self.user, self.pancakes)
+        self.cart(self.user, self.omelette)
+        self.cart(self.user, self.pancakes, method="delete")
+        self.assertEqual(self.totals(self.user), {"Молоко": 100, "Яйцо": 3})
+        self.assert_consistent()
+        self.cart(self.user, self.omelette, method="delete")
+        self.assertEqual(self.totals(self.user), {})
+        self.assert_consistent()
+
+    def test_quantity_change(self):
+        self.cart(self.user, self.omelette, 2)
+        self.cart(self.user, self.omelette, 5)
+        self.assertEqual(self.totals(self.user), {"Молоко": 500, "Яйцо": 15})
+        self.assert_consistent()
+        self.cart(self.user, self.omelette, 1)
+        self.assertEqual(self.totals(self.user), {"Молоко": 100, "Яйцо": 3})
+        self.assert_consistent()
+
+    def test_recipe_ingredients_edit(self):
+        self.cart(self.user, self.pancakes, 2)
+        self.cart(self.other, self.pancakes)
+        self.cart(self.other, self.omelette)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f"/api/recipes/{self.pancakes.pk}/",
+            {"tags": [self.tag.pk], "ingredients": [
+                {"id": self.flour.pk, "amount": 300},
+                {"id": self.egg.pk, "amount": 2},
+            ]},
+            format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.totals(self.user), {"Мука": 600, "Яйцо": 4})
+        self.assert_consistent()
+
+    def test_recipe_delete(self):
+        self.cart(self.user, self.pancakes)
+        self.cart(self.user, self.omelette, 2)
+        self.cart(self.other, self.pancakes)
+        self.client.force_authenticate(self.author)
+        response = self.client.delete(f"/api/recipes/{self.pancakes.pk}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.totals(self.user), {"Молоко": 200, "Яйцо": 6})
+        self.assertEqual(self.totals(self.other), {})
+        self.assert_consistent()
+
+    def test_rebuild(self):
+        self.cart(self.user, self.pancakes, 2)
+        self.cart(self.user, self.omelette)
+        self.cart(self.other, self.omelette, 3)
+        before = self.totals(self.user), self.totals(self.other)
+        rebuild(User.objects.filter(pk=self.user.pk))
+        self.assertEqual((self.totals(self.user), self.totals(self.other)),
+                         before)
+        self.assert_consistent()
+
+
+class IncrementalExportTest(APITestCase):
+    """Инкрементальная выгрузка видит правки состава, тегов и удаления."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username="admin",
+                                        email="admin@example.com",
+                                        is_staff=True)
+        cls.tag = Tag.objects.create(name="Тег", color="#FFFFFF", slug="tag")
+        cls.salt, cls.sugar = [
+            Ingredient.objects.create(name=name, measurement_unit="г")
+            for name in ("Соль", "Сахар")
+        ]
+        cls.soup, cls.cake = [
+            Recipes.objects.create(author=cls.admin, name=name, text="Текст",
+                                   cooking_time=10)
+            for name in ("Суп", "Торт")
+        ]
+        cls.soup_salt = RecipeIngredient.objects.create(
+            recipe=cls.soup, ingredient=cls.salt, amount=5)
+        RecipeIngredient.objects.create(recipe=cls.cake,
+                                        ingredient=cls.sugar, amount=200)
+
+    def setUp(self):
+        self.since = timezone.now()
+
+    def changed(self):
+        return ({recipe.name for recipe in export.recipes(self.since)},
+                {recipe.recipe_id for recipe in export.deleted(self.since)})
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.changed(), (set(), set()))
+
+    def test_recipe_ingredient_edit(self):
+        self.soup_salt.amount = 10
+        self.soup_salt.save()
+        self.assertEqual(self.changed(), ({"Суп"}, set()))
+
+    def test_recipe_ingredient_delete(self):
+        RecipeIngredient.objects.filter(recipe=self.cake).delete()
+        self.assertEqual(self.changed(), ({"Торт"}, set()))
+
+    def test_ingredient_rename(self):
+        self.sugar.name = "Сахарная пудра"
+        self.sugar.save()
+        self.assertEqual(self.changed(), ({"Торт"}, set()))
+
+    def test_tags(self):
+        self.soup.tags.add(self.tag)
+        self.assertEqual(self.changed(), ({"Суп"}, set()))
+        self.since = timezone.now()
+        self.tag.slug = "soup"
+        self.tag.save()
+        self.assertEqual(self.changed(), ({"Суп"}, set()))
+
+    def test_delete(self):
+        cake_id = self.cake.pk
+        self.cake.delete()
+        self.assertEqual(self.changed(), (set(), {cake_id}))
+
+    def test_endpoint(self):
+        cake_id = self.cake.pk
+        self.cake.delete()
+        self.client.force_authenticate(self.admin)
+        response = self.client.get("/api/recipes/export/", {
+            "since": self.since.isoformat()})
+        rows = [json.loads(line) for line
+                in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(rows, [{
+            "id": cake_id, "deleted": True,
+            "updated_at": rows[0]["updated_at"]}])
+        started = datetime.fromisoformat(response["X-Exported-At"])
+        self.assertEqual(datetime.fromisoformat(response["X-Next-Since"]),
+                         started - export.SINCE_OVERLAP)
+
+
+class SubscribeTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = [
+            User.objects.create(username=name, email=f"{name}@example.com")
+            for name in ("user", "author")
+        ]
+
+    def test_subscribe_twice(self):
+        self.client.force_authenticate(self.user)
+        url = f"/api/users/{self.author.pk}/subscribe/"
+        self.assertEqual(self.client.post(url).status_code, 201)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.data)
+        self.assertEqual(self.client.delete(url).status_code, 200)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+
+
+class RecipeImportTest(TemporaryMediaMixin, APITestCase):
+    """Ошибки во входных данных импорта отклоняют строку, а не запрос."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username="admin",
+                                        email="admin@example.com",
+                                        is_staff=True)
+        Ingredient.objects.create(name="Соль", measurement_unit="г")
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.admin)
+
+    def post(self, *rows):
+        return self.client.post(
+            "/api/recipes/import/?file_format=ndjson", b"\n".join(rows),
+            content_type="application/x-ndjson")
+
+    def row(self, **fields):
+        return json.dumps({
+            "name": "Суп", "text": "Текст", "cooking_time": 10,
+            "ingredients": [{"name": "соль", "measurement_unit": "г",
+                             "amount": 5}],
+            **fields}, ensure_ascii=False).encode()
+
+    def test_unsafe_image_path(self):
+        response = self.post(self.row(image="../../etc/passwd"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["errors"], [{
+            "line": 1, "error": "image: недопустимый путь ../../etc/passwd"}])
+
+    def test_invalid_utf8(self):
+        response = self.post(self.row().replace("Суп".encode(), b"\xff\xfe"),
+                             self.row())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["imported"], 1)
+        self.assertEqual(response.data["errors"], [{
+            "line": 1, "error": "некорректная кодировка, ожидается UTF-8"}])
@@ -0,0 +1,126 @@
+"""Загрузка изображений по частям.
+
+Клиент получает токен, дописывает файл частями с заголовком
+Upload-Offset (после обрыва узнает смещение и продолжает с него),
+а затем передает в рецепте image="upload:<токен>". Части пишутся
+на диск потоком, в памяти держится не больше READ_SIZE байт.
+"""
+import os
+import re
+import secrets
+import time
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image, UnidentifiedImageError
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+TOKEN_PREFIX: str = "upload:"
+READ_SIZE: int = 64 * 1024
+TOKEN_PATTERN = re.compile(r"^[\w-]{22}$")
+
+
+class OffsetConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Смещение не совпадает с уже загруженным размером."
+    default_code = "offset_conflict"
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Превышен допустимый размер загрузки."
+    default_code = "upload_too_large"
+
+
+class ChunkedUploadedFile(UploadedFile):
+    """Собранный файл; FileSystemStorage переносит его без копирования."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def _user_dir(user):
+    return os.path.join(settings.UPLOADS_ROOT, str(user.pk))
+
+
+def _path(user, token):
+    if not TOKEN_PATTERN.match(token):
+        raise NotFound("Загрузка не найдена.")
+    path = os.path.join(_user_dir(user), token)
+    if not os.path.exists(path):
+        raise NotFound("Загрузка не найдена.")
+    return path
+
+
+def _clear_expired(directory):
+    expired = time.time() - settings.UPLOAD_TTL
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < expired:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def start(user):
+    """Начать загрузку; возвращает токен."""
+    directory = _user_dir(user)
+    os.makedirs(directory, exist_ok=True)
+    _clear_expired(directory)
+    token = secrets.token_urlsafe(16)
+    open(os.path.join(directory, token), "xb").close()
+    return token
+
+
+def offset(user, token):
+    return os.path.getsize(_path(user, token))
+
+
+def append(user, token, start_offset, stream, length):
+    """Дописать часть длиной length байт, читая ее из stream.
+
+    Возвращает новое смещение.
+    """
+    path = _path(user, token)
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadTooLarge("Слишком большая часть.")
+    with open(path, "r+b") as file:
+        current = file.seek(0, os.SEEK_END)
+        if start_offset != current:
+            raise OffsetConflict(
+                f"Загружено {current} байт, часть начинается "
+                f"с {start_offset}.")
+        if current + length > settings.UPLOAD_MAX_SIZE:
+            raise UploadTooLarge()
+        remaining = length
+        while remaining:
+            chunk = stream.read(min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            file.write(chunk)
+            remaining -= len(chunk)
+        if remaining:
+            file.truncate(current)
+            raise OffsetConflict("Часть получена не полностью.")
+        return file.tell()
+
+
+def open_upload(user, token):
+    """Файл завершенной загрузки для поля изображения.
+
+    Файл открыт; закрыть его должен вызывающий код.
+    """
+    path = _path(user, token)
+    name = token
+    try:
+        with Image.open(path) as image:
+            name = f"{token}.{image.format.lower()}"
+    except (UnidentifiedImageError, OSError):
+        pass
+    return ChunkedUploadedFile(
+        file=open(path, "rb"),
+        name=name,
+        size=os.path.getsize(path),
+    )
@@ -6,6 +6,7 @@ from .views import (
     IngredientViewSet,
     RecipesViewSet,
     TagViewSet,
+    UploadViewSet,
     UserViewSet,
     AddRecipeToShoppingCartViewSet
 )
@@ -20,3 +21,4 @@ router.register(r"favorites", FavoritesViewSet, basename="favorites")
 router.register(r"subscribe", FollowViewSet, basename="subscribe")
 router.register(r"shopping_cart", AddRecipeToShoppingCartViewSet,
                 basename="basket")
+router.register(r"uploads", UploadViewSet, basename="uploads")
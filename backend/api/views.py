@@ -1,22 +1,33 @@
-from django.db.models import Q
-from django.http import HttpResponse
+import codecs
+
+from django.db.models import Count, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Upper
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.generics import RetrieveAPIView
-from rest_framework.permissions import AllowAny, IsAuthenticatedOrReadOnly
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated,
+                                        IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from users.models import User
 from api.permissions import IsAuthorOrReadOnlyPermission
+from . import export, importer, metrics, shopping_list, uploads
+from .cache import ReferenceCacheMixin
 from .models import (Basket, Favorites, Follow,
-                     Ingredient, Recipes, Tag)
-from .pagination import Pagination
+                     Ingredient, Recipes, Tag, search_key)
+from .pagination import HybridPagination, Pagination
+from .parsers import MultiPartJSONParser
+from .relations import user_relations
 from .serializers import (
     ChangePasswordSerializer, ConfirmationSerializer,
     FavoritesSerializer, FollowSerializer, IngredientSerializer,
@@ -24,14 +35,17 @@ from .serializers import (
     BasketSerializer
 )
 
+INGREDIENTS_SEARCH_LIMIT: int = 20
+INGREDIENTS_SEARCH_MAX_LIMIT: int = 100
+
 
 class UserViewSet(viewsets.ModelViewSet):
     """Работа с user"""
 
-    queryset = User.objects.all()
+    queryset = User.objects.order_by("-id")
     serializer_class = UserSerializer
     http_method_names = ["get", "post", "patch", "delete"]
-    pagination_class = Pagination
+    pagination_class = HybridPagination
     permission_classes = [AllowAny]
 
     @action(methods=["post"], detail=False, url_path="set_password")
@@ -80,11 +94,16 @@ class GetToken(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         email = serializer.validated_data.get("email")
         password = serializer.validated_data.get("password")
-        user = User.objects.filter(email=email).first()
+        # Сравнение через UPPER с обеих сторон использует индекс
+        # user_email_upper и на PostgreSQL, и на SQLite.
+        user = User.objects.alias(email_upper=Upper("email")).filter(
+            email_upper=Upper(Value(email))).first()
         if user is not None and user.check_password(password):
             token, created = Token.objects.get_or_create(user=user)
+            metrics.auth_attempt("login", True)
             return Response({"auth_token": token.key},
                             status=status.HTTP_200_OK)
+        metrics.auth_attempt("login", False)
         return Response(
             {"detail": "Invalid credentials"},
             status=status.HTTP_400_BAD_REQUEST
@@ -98,15 +117,17 @@ class TokenDeleteView(APIView):
         token = request.auth
         if isinstance(token, RefreshToken):
             token.blacklist()
+        metrics.auth_attempt("logout", True)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def post(self, request):
         return self.delete(request)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ReferenceCacheMixin, viewsets.ModelViewSet):
     """Вывод всех тегов и тегов по id"""
 
+    cache_group = "tags"
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
@@ -115,51 +136,198 @@ class TagViewSet(viewsets.ModelViewSet):
 class RecipesViewSet(viewsets.ModelViewSet):
     """Вывод рецептов-рецептов по id,
     Создание рецепта,
-    Поиск по тегам,
-    Поиск по is_favorited.
+    Поиск по тегам (slug в tags, часть названия в tags__name),
+    Полнотекстовый поиск по названию и описанию (search),
+    Поиск по is_favorited и is_in_shopping_cart.
     """
 
     queryset = Recipes.objects.all()
     serializer_class = RecipesSerializer
-    pagination_class = Pagination
+    pagination_class = HybridPagination
     permission_classes = [IsAuthenticatedOrReadOnly]
+    parser_classes = (JSONParser, MultiPartJSONParser)
     filter_backends = (DjangoFilterBackend,)
     filterset_fields = ("name",)
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        is_favorited = self.request.query_params.get("is_favorited")
-
-        if is_favorited == "1":
-            user = self.request.user
-            favorited_recipes = (
-                Favorites.objects.filter(user=user).values_list("recipe",
-                                                                flat=True))
-            queryset = queryset.filter(pk__in=favorited_recipes)
+        user = self.request.user
+        queryset = (super().get_queryset()
+                    .with_user_flags(user)
+                    .with_related(user))
+        for flag in ("is_favorited", "is_in_shopping_cart"):
+            if self.request.query_params.get(flag) == "1":
+                if not user.is_authenticated:
+                    return queryset.none()
+                queryset = queryset.filter(**{flag: True})
+
+        search = self.request.query_params.get("search")
+        if search:
+            queryset = queryset.search(search)
+
+        tags_slugs = self.request.query_params.getlist("tags")
+        if tags_slugs:
+            queryset = queryset.with_tags(
+                Tag.objects.filter(slug__in=tags_slugs))
 
         tags_names = self.request.query_params.getlist("tags__name")
         if tags_names:
             tags_filter = Q()
             for tag_name in tags_names:
-                tags_filter |= Q(tags__name__icontains=tag_name)
-            queryset = queryset.filter(tags_filter).distinct()
+                tags_filter |= Q(name__icontains=tag_name)
+            queryset = queryset.with_tags(Tag.objects.filter(tags_filter))
 
         return queryset
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user,
-                        recipe_ingredients=self.request.data.get("ingredients")
-                        )
+        serializer.save(author=self.request.user)
+        self.reload(serializer)
 
+    def perform_update(self, serializer):
+        serializer.save()
+        self.reload(serializer)
+
+    def reload(self, serializer):
+        """Перечитать рецепт для ответа вместе с флагами и связями."""
+        serializer.instance = self.get_queryset().get(
+            pk=serializer.instance.pk)
+
+    @action(detail=False, methods=["get"], url_path="export",
+            permission_classes=[IsAdminUser])
+    def export_recipes(self, request):
+        """
+        Выгрузка всех рецептов (file_format=ndjson или csv),
+        since - только измененные и удаленные с этого момента (значение
+        для следующей выгрузки - в заголовке X-Next-Since),
+        gzip=1 - со сжатием.
+        """
+        file_format = request.query_params.get("file_format", "ndjson")
+        if file_format not in export.FORMATS:
+            raise ValidationError(
+                {"file_format": [f"Доступные форматы: "
+                                 f"{', '.join(export.FORMATS)}."]})
+        since = request.query_params.get("since")
+        try:
+            since = export.parse_since(since) if since else None
+        except ValueError as error:
+            raise ValidationError({"since": [str(error)]})
+        content_type, render = export.FORMATS[file_format]
+        started = timezone.now()
+
+        filename = f"recipes.{file_format}"
+        chunks = render(export.recipes(since), export.deleted(since))
+        if request.query_params.get("gzip") == "1":
+            filename += ".gz"
+            content_type = "application/gzip"
+            chunks = export.gzip_stream(chunks)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="{filename}"')
+        response["X-Exported-At"] = started.isoformat()
+        # Значение since для следующей инкрементальной выгрузки.
+        response["X-Next-Since"] = export.next_since(started).isoformat()
+        return response
+
+    @action(detail=False, methods=["post"], url_path="import",
+            permission_classes=[IsAdminUser], parser_classes=())
+    def import_recipes(self, request):
+        """Импорт рецептов из тела запроса (NDJSON или CSV, ?file_format=)."""
+        file_format = request.query_params.get("file_format") or (
+            "csv" if request.content_type.startswith("text/csv")
+            else "ndjson")
+        if file_format not in importer.FORMATS:
+            raise ValidationError(
+                {"file_format": [f"Доступные форматы: "
+                                 f"{', '.join(importer.FORMATS)}."]})
+        if request.stream is None:
+            raise ValidationError({"error": "Пустое тело запроса"})
+        report = importer.RecipeImporter(request.user).run(
+            importer.FORMATS[file_format](
+                codecs.iterdecode(request.stream, "utf-8-sig",
+                                  errors="replace")))
+        return Response(report, status=status.HTTP_201_CREATED
+                        if report["imported"] else status.HTTP_400_BAD_REQUEST)
+
+
+class UploadViewSet(viewsets.ViewSet):
+    """
+    Загрузка изображения по частям:
+    POST создает загрузку и возвращает токен,
+    PATCH с заголовком Upload-Offset дописывает часть из тела запроса,
+    HEAD/GET возвращают, сколько байт уже получено.
+    Готовый файл передается в рецепте как image="upload:<token>".
+    """
+
+    permission_classes = [IsAuthenticated]
+    parser_classes = ()
+    lookup_field = "token"
+    lookup_value_regex = r"[\w-]+"
+
+    def create(self, request):
+        token = uploads.start(request.user)
+        return Response(
+            {"token": token, "image": uploads.TOKEN_PREFIX + token,
+             "offset": 0},
+            status=status.HTTP_201_CREATED,
+        )
 
-class IngredientViewSet(viewsets.ModelViewSet):
+    def retrieve(self, request, token):
+        offset = uploads.offset(request.user, token)
+        response = Response({"token": token, "offset": offset})
+        response["Upload-Offset"] = offset
+        return response
+
+    def partial_update(self, request, token):
+        try:
+            offset = int(request.headers["Upload-Offset"])
+            length = int(request.headers["Content-Length"])
+        except (KeyError, ValueError):
+            raise ValidationError(
+                {"error": "Нужны заголовки Upload-Offset и Content-Length"})
+        offset = uploads.append(request.user, token, offset,
+                                request.stream, length)
+        response = Response({"token": token, "offset": offset})
+        response["Upload-Offset"] = offset
+        return response
+
+
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ModelViewSet):
     """
     Получить список всех ингедиентов,
+    Подсказки по началу названия (name) с ограничением limit.
     """
+    cache_group = "ingredients"
     permission_classes = [IsAuthenticatedOrReadOnly]
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
 
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get("name"):
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(self.autocomplete, request,
+                                    *args, **kwargs)
+
+    def search_params(self, request):
+        """Префикс без учета регистра и ограничение числа подсказок."""
+        try:
+            limit = int(request.query_params.get(
+                "limit", INGREDIENTS_SEARCH_LIMIT))
+        except ValueError:
+            limit = INGREDIENTS_SEARCH_LIMIT
+        limit = min(max(limit, 1), INGREDIENTS_SEARCH_MAX_LIMIT)
+        return search_key(request.query_params.get("name", "")), limit
+
+    def cache_params(self, request):
+        # "Сол", "сол" и "СОЛ" - один ответ и одна запись в кэше.
+        if request.query_params.get("name"):
+            return self.search_params(request)
+        return super().cache_params(request)
+
+    def autocomplete(self, request, *args, **kwargs):
+        name, limit = self.search_params(request)
+        ingredients = Ingredient.objects.autocomplete(name, limit)
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
 
 class AddRecipeToShoppingCartViewSet(viewsets.ModelViewSet):
     serializer_class = BasketSerializer
@@ -168,71 +336,48 @@ class AddRecipeToShoppingCartViewSet(viewsets.ModelViewSet):
 
     def create(self, request, id):
         recipe = get_object_or_404(Recipes, pk=id)
-        quantity = int(request.data.get("quantity", 1))
-        cooking_time = int(request.data.get("cooking_time", 0))
-
         serializer = self.get_serializer(
             data={
                 "recipe": recipe.id,
-                "cooking_time": cooking_time
-            },
-            context={
-                "request": request,
-                "recipe": recipe,
-                "quantity": quantity,
-                "cooking_time": cooking_time
+                "quantity": request.data.get("quantity", 1),
             }
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        user_relations(request).set_in_shopping_cart(recipe.id)
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def destroy(self, request, id):
-        recipe_id = int(id)
-        baskets = Basket.objects.filter(user=request.user, recipe_id=recipe_id)
+        deleted, _ = Basket.objects.filter(
+            user=request.user, recipe_id=id).delete()
 
-        if baskets.exists():
-            baskets.delete()
+        if deleted:
+            user_relations(request).set_in_shopping_cart(int(id), False)
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
 
 @api_view(["GET"])
-@permission_classes([IsAuthorOrReadOnlyPermission])
+@permission_classes([IsAuthenticated])
 def download_shopping_list(request):
     """
-    Скачать рецепт из корзины.
+    Скачать список покупок из корзины (file_format=txt или csv).
     """
-    user = request.user
-    shopping_list = Basket.objects.filter(user=user)
-
-    response = HttpResponse(content_type="text/plain")
+    file_format = request.query_params.get("file_format", "txt")
+    if file_format not in shopping_list.FORMATS:
+        raise ValidationError(
+            {"file_format": [f"Доступные форматы: "
+                             f"{', '.join(shopping_list.FORMATS)}."]})
+    content_type, render = shopping_list.FORMATS[file_format]
+
+    response = StreamingHttpResponse(
+        render(shopping_list.shopping_list(request.user)),
+        content_type=content_type,
+    )
     response["Content-Disposition"] = (
-        'attachment; filename="shopping_list.txt"')
-
-    total_quantity = {}
-
-    for basket in shopping_list:
-        recipe = basket.recipe
-        recipe_ingredients = recipe.recipe_ingredients.all()
-        message = "Спасибо что пользуетесь нашим сервисом!"
-
-        for recipe_ingredient in recipe_ingredients:
-            ingredient_name = recipe_ingredient.ingredient.name
-            quantity = basket.quantity * recipe_ingredient.amount
-            measurement_unit = recipe_ingredient.measurement_unit
-
-            if ingredient_name in total_quantity:
-                total_quantity[ingredient_name] += quantity
-            else:
-                total_quantity[ingredient_name] = quantity
-
-    for ingredient_name, total_quantity in total_quantity.items():
-        response.write(
-            f"{ingredient_name} {total_quantity} {measurement_unit}\n")
-    response.write(f"{message}")
+        f'attachment; filename="shopping_list.{file_format}"')
     return response
 
 
@@ -248,7 +393,7 @@ class FavoritesViewSet(viewsets.GenericViewSet):
     lookup_field = "recipe_id"
 
     def get_queryset(self):
-        return self.request.user.favorite_user.all()
+        return self.request.user.favorite_user.select_related("recipe")
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -257,29 +402,21 @@ class FavoritesViewSet(viewsets.GenericViewSet):
 
     def create(self, request, *args, **kwargs):
         recipe_id = self.kwargs.get("recipe_id")
-        recipe = get_object_or_404(Recipes, pk=recipe_id)
-        favorites_exists = Favorites.objects.filter(
-            user=request.user, recipe=recipe
-        ).exists()
-
-        if favorites_exists:
-            raise ValidationError({"error": "Рецепт уже добавлен в избранное"})
-
-        if not recipe:
-            return Response(
-                {"error": "Рецепт не найден"}, status=status.HTTP_404_NOT_FOUND
-            )
-
+        recipe = get_object_or_404(
+            Recipes.objects.only("id", "name", "image", "cooking_time"),
+            pk=recipe_id,
+        )
         favorites, created = Favorites.objects.get_or_create(
             user=request.user,
             recipe=recipe,
         )
 
+        if not created:
+            raise ValidationError({"error": "Рецепт уже добавлен в избранное"})
+        user_relations(request).set_favorited(recipe.id)
+
         serializer = self.get_serializer(favorites)
-        return Response(
-            serializer.data,
-            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
-        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def destroy(self, request, *args, **kwargs):
         recipe_id = self.kwargs.get("recipe_id")
@@ -289,6 +426,7 @@ class FavoritesViewSet(viewsets.GenericViewSet):
 
         if favorites:
             favorites.delete()
+            user_relations(request).set_favorited(favorites.recipe_id, False)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response(
@@ -304,7 +442,7 @@ class FollowViewSet(viewsets.ModelViewSet):
     queryset = Follow.objects.all()
     serializer_class = FollowSerializer
     subscription_serializer = FollowSerializer
-    pagination_class = Pagination
+    pagination_class = HybridPagination
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def create(self, request, *args, **kwargs):
@@ -314,33 +452,68 @@ class FollowViewSet(viewsets.ModelViewSet):
             user=request.user,
             author=author,
         )
-        if created:
-            serializer = FollowSerializer(
-                follow, context={"request": request, "user_id": user_id}
-            )
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        if not created:
+            raise ValidationError(
+                {"error": "Вы уже подписаны на этого пользователя"})
+        user_relations(request).set_subscribed(author.pk)
+        serializer = FollowSerializer(
+            follow, context={
+                "request": request,
+                "user_id": user_id,
+                "author_recipes": self.get_author_recipes([follow]),
+            }
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def destroy(self, request, *args, **kwargs):
         user_id = self.kwargs.get("user_id")
         follow = Follow.objects.filter(user=request.user,
-                                       user_id=user_id).first()
+                                       author_id=user_id).first()
 
         if follow:
             user_obj = follow.user
             follow.delete()
+            user_relations(request).set_subscribed(follow.author_id, False)
             serializer = UserMeSerializer(user_obj,
                                           context={"request": request})
             return Response(serializer.data)
 
+        return Response(
+            {"error": "Вы не подписаны на этого пользователя"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
     def get_queryset(self):
-        return Follow.objects.filter(user=self.request.user)
+        return Follow.objects.filter(
+            user=self.request.user
+        ).order_by("-id").select_related("author").annotate(
+            recipes_count=Coalesce(Subquery(
+                Recipes.objects.filter(author=OuterRef("author"))
+                .order_by().values("author")
+                .annotate(count=Count("id")).values("count")
+            ), 0),
+        )
+
+    def get_author_recipes(self, follows):
+        """Рецепты авторов из follows с учетом recipes_limit."""
+        try:
+            limit = int(self.request.query_params["recipes_limit"])
+        except (KeyError, ValueError):
+            limit = None
+        author_recipes = {follow.author_id: [] for follow in follows}
+        for recipe in Recipes.objects.latest_for_authors(
+                author_recipes, limit):
+            author_recipes[recipe.author_id].append(recipe)
+        return author_recipes
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        paginator = Pagination()
-        paginated_queryset = paginator.paginate_queryset(queryset, request,
-                                                         view=self)
+        paginated_queryset = self.paginate_queryset(queryset)
         serializer = self.subscription_serializer(
-            paginated_queryset, many=True, context={"request": request}
+            paginated_queryset, many=True, context={
+                "request": request,
+                "author_recipes": self.get_author_recipes(
+                    paginated_queryset),
+            }
         )
-        return paginator.get_paginated_response(serializer.data)
+        return self.get_paginated_response(serializer.data)
@@ -31,6 +31,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.metrics.MetricsMiddleware",
+    "api.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -60,17 +62,46 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "foodgram_backend.wsgi.application"
 
+TEST_RUNNER = "foodgram_backend.test_runner.TestRunner"
 
-DATABASES = {
+
+DB_ENGINE = os.getenv("DB_ENGINE", "postgresql")
+
+if DB_ENGINE == "sqlite3":
+    # Локальная разработка, тесты и benchmark_endpoints без PostgreSQL.
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB", "django"),
+            "USER": os.getenv("POSTGRES_USER", "django"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("DB_HOST", ""),
+            "PORT": os.getenv("DB_PORT", 5432)
+        }
+    }
+
+# В docker-compose кэш - Redis, общий для всех процессов gunicorn и
+# команд manage.py. Без него используется кэш в памяти процесса: сброс
+# версии справочника (api.cache.invalidate) увидит только процесс,
+# который его сделал, поэтому версия живет не дольше
+# REFERENCE_CACHE_VERSION_TIMEOUT секунд.
+CACHE_BACKEND = os.getenv(
+    "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache")
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
-        "NAME": os.getenv("POSTGRES_DB", "django"),
-        "USER": os.getenv("POSTGRES_USER", "django"),
-        "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
-        "HOST": os.getenv("DB_HOST", ""),
-        "PORT": os.getenv("DB_PORT", 5432)
+        "BACKEND": CACHE_BACKEND,
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
     }
 }
+REFERENCE_CACHE_VERSION_TIMEOUT = (
+    60 if CACHE_BACKEND.endswith(".LocMemCache") else None)
 
 AUTH_PASSWORD_VALIDATORS = [{
     "NAME":
@@ -104,6 +135,47 @@ MEDIA_URL = "/media/"
 
 MEDIA_ROOT = BASE_DIR / "media"
 
+IMAGE_MAX_SIZE = int(os.getenv("IMAGE_MAX_SIZE", 2048))
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
+FILE_UPLOAD_HANDLERS = [
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+UPLOADS_ROOT = BASE_DIR / "uploads"
+
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 20 * 1024 * 1024))
+
+UPLOAD_CHUNK_MAX_SIZE = 4 * 1024 * 1024
+
+UPLOAD_TTL = 24 * 60 * 60
+
+PROFILING_ENABLED = os.getenv("PROFILING", "false").lower() == "true"
+
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0.1))
+
+PROFILING_SLOW_MS = int(os.getenv("PROFILING_SLOW_MS", 500))
+
+PROFILING_DUPLICATE_THRESHOLD = int(
+    os.getenv("PROFILING_DUPLICATE_THRESHOLD", 3))
+
+METRICS_ENABLED = os.getenv("METRICS", "true").lower() == "true"
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api.profiling": {"handlers": ["console"], "level": "INFO",
+                          "propagate": False},
+    },
+}
+
 AUTH_USER_MODEL = "users.User"
 
 REST_FRAMEWORK = {
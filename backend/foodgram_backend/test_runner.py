@@ -0,0 +1,18 @@
+from contextlib import ExitStack
+
+from django.test.runner import DiscoverRunner
+
+from api import cache
+
+
+class TestRunner(DiscoverRunner):
+    """Запускает тесты с отдельным кэшем в памяти (api.cache.isolated)."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache = ExitStack()
+        self._cache.enter_context(cache.isolated())
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache.close()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,4 @@
+from api.metrics import metrics_view
 from api.urls import router
 from api.views import (
     AddRecipeToShoppingCartViewSet,
@@ -15,6 +16,7 @@ from django.urls import include, path
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", metrics_view, name="metrics"),
     path("auth/", include("djoser.urls")),
     path("auth/", include("djoser.urls.jwt")),
     path("api/auth/token/login/", GetToken.as_view(), name="token"),
@@ -33,7 +35,8 @@ urlpatterns = [
     ),
     path(
         "api/recipes/<int:recipe_id>/favorite/",
-        FavoritesViewSet.as_view({"post": "create", "delete": "destroy"}),
+        FavoritesViewSet.as_view(
+            {"get": "retrieve", "post": "create", "delete": "destroy"}),
         name="favorite-recepi",
     ),
     path(
@@ -0,0 +1,22 @@
+import os
+import shutil
+
+# Метрики Prometheus общие для всех процессов: каждый пишет их в файлы
+# этого каталога. Переменная должна быть задана до импорта
+# prometheus_client, поэтому здесь, а не в настройках Django.
+METRICS_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/foodgram-metrics")
+
+workers = int(os.getenv("GUNICORN_WORKERS", 3))
+
+
+def on_starting(server):
+    # Счетчики прошлого запуска не должны попасть в новые метрики.
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:34
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                django.db.models.functions.text.Upper("email"), name="user_email_upper"
+            ),
+        ),
+    ]
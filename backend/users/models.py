@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Upper
 
 
 class User(AbstractUser):
@@ -31,6 +32,10 @@ class User(AbstractUser):
     class Meta:
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
+        indexes = [
+            # Вход по email без учета регистра (GetToken).
+            models.Index(Upper("email"), name="user_email_upper"),
+        ]
 
     def __str__(self):
         return self.username